@@ -0,0 +1,247 @@
+"""
+A lightweight JSON API over the same data and models as the app.
+
+    python api.py --port 8080
+
+Endpoints:
+    GET /countries                  Names of all countries and the date the data was last refreshed.
+    GET /countries/<country>        Latest statistics for a country.
+    GET /forecast?country=<country>&asymptomatic_contacts=<int>&symptomatic_contacts=<int>
+                                    Day-by-day forecast and headline numbers.
+    GET /headline?country=<country>&asymptomatic_contacts=<int>&symptomatic_contacts=<int>
+                                    Approximate headline numbers, computed without running the simulation.
+    GET /age_breakdown?country=<country>&asymptomatic_contacts=<int>&symptomatic_contacts=<int>
+                                    Forecast outcomes by age group.
+
+Contact rates default to the same values as the sliders in the app. Requests are handled asynchronously and
+simulations run on a process pool, so the event loop stays responsive. Identical concurrent requests share a single
+computation.
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+import tornado.ioloop
+import tornado.web
+
+import forecast
+import models
+from data import constants
+from data.constants import SymptomState
+from data.countries import fetch_country_data
+
+# Checking the shared snapshot is cheap, the data itself is only rebuilt once it goes stale
+_DATA_REFRESH_PERIOD = datetime.timedelta(minutes=1)
+
+_CONTACT_RATE_ARGUMENTS = {
+    SymptomState.ASYMPTOMATIC: "asymptomatic_contacts",
+    SymptomState.SYMPTOMATIC: "symptomatic_contacts",
+}
+
+
+def _compute_forecast(country_data, contact_rate):
+    df, summary = forecast.get_forecast(country_data, contact_rate)
+    peak_occupancy, num_dead, num_recovered = forecast.get_headline_numbers(summary)
+    return {
+        "forecast": {
+            status: df.loc[df.Status == status, "Forecast"].tolist()
+            for status in df.Status.unique()
+        },
+        "peak_hospitalization": peak_occupancy,
+        "dead": num_dead,
+        "recovered": num_recovered,
+        "summary": summary.to_dict(),
+    }
+
+
+def _compute_age_breakdown(country_data, contact_rate):
+    _, summary = forecast.get_forecast(country_data, contact_rate)
+    _, num_dead, num_recovered = forecast.get_headline_numbers(summary)
+    return models.get_status_by_age_group(num_dead, num_recovered).to_dict(
+        orient="index"
+    )
+
+
+def _to_json(obj):
+    def default(o):
+        # NumPy scalars sneak in from pandas
+        if isinstance(o, np.generic):
+            return o.item()
+        raise TypeError(f"{type(o)} is not JSON serializable")
+
+    return json.dumps(obj, default=default)
+
+
+class ForecastService:
+    """
+    Holds the country data and runs simulations on a worker pool, coalescing identical concurrent requests.
+    """
+
+    def __init__(self, executor):
+        self._executor = executor
+        self._in_flight = {}
+        self.countries = None
+
+    @property
+    def country_data(self):
+        return self.countries.country_data
+
+    def refresh(self):
+        self.countries = fetch_country_data()
+
+    async def run(self, compute, country, contact_rate):
+        """
+        Run `compute(country_data, contact_rate)` on the worker pool. If the same computation is already in flight,
+        wait for its result instead of starting another one.
+        """
+        key = (
+            compute.__name__,
+            self.countries.version,
+            country,
+            tuple(contact_rate[state] for state in SymptomState),
+        )
+        future = self._in_flight.get(key)
+        if future is None:
+            future = asyncio.get_event_loop().run_in_executor(
+                self._executor, compute, self.country_data[country], contact_rate
+            )
+            self._in_flight[key] = future
+            future.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        # Shield so that one client going away doesn't cancel the computation for the others
+        return await asyncio.shield(future)
+
+
+class _JSONHandler(tornado.web.RequestHandler):
+    def initialize(self, service):
+        self.service = service
+
+    def write_json(self, obj):
+        self.set_header("Content-Type", "application/json")
+        self.write(_to_json(obj))
+
+    def write_error(self, status_code, **kwargs):
+        # JSON like the other responses, rather than tornado's HTML error page
+        message = self._reason
+        exception = kwargs.get("exc_info", (None, None))[1]
+        if isinstance(exception, tornado.web.HTTPError) and exception.reason is None and exception.log_message:
+            # e.g. a missing argument, whose reason is only the generic "Bad Request"
+            message = exception.log_message % exception.args
+        self.write_json({"error": message, "status": status_code})
+
+    def get_country(self, country):
+        if country not in self.service.country_data:
+            raise tornado.web.HTTPError(404, reason=f"Unknown country: {country}")
+        return country
+
+    def get_contact_rate(self):
+        contact_rate = {}
+        for state, argument in _CONTACT_RATE_ARGUMENTS.items():
+            value = self.get_argument(
+                argument, str(constants.AverageDailyContacts.default[state])
+            )
+            try:
+                value = int(value)
+            except ValueError:
+                raise tornado.web.HTTPError(400, reason=f"{argument} must be an integer")
+            if not constants.AverageDailyContacts.min <= value <= constants.AverageDailyContacts.max:
+                raise tornado.web.HTTPError(
+                    400,
+                    reason=f"{argument} must be between {constants.AverageDailyContacts.min} "
+                    f"and {constants.AverageDailyContacts.max}",
+                )
+            contact_rate[state] = value
+        return contact_rate
+
+
+class CountriesHandler(_JSONHandler):
+    def get(self):
+        self.write_json(
+            {
+                "countries": self.service.country_data.countries,
+                "last_modified": self.service.countries.last_modified,
+            }
+        )
+
+
+class CountryHandler(_JSONHandler):
+    def get(self, country):
+        country_data = self.service.country_data[self.get_country(country)].to_dict()
+        # NaN isn't valid JSON, e.g. the calibration loss of countries without a fit
+        self.write_json(
+            {key: None if value != value else value for key, value in country_data.items()}
+        )
+
+
+class ForecastHandler(_JSONHandler):
+    async def get(self):
+        country = self.get_country(self.get_argument("country"))
+        self.write_json(
+            await self.service.run(_compute_forecast, country, self.get_contact_rate())
+        )
+
+
+class HeadlineHandler(_JSONHandler):
+    def get(self):
+        country = self.get_country(self.get_argument("country"))
+        # Takes under a millisecond, so not worth sending to the worker pool
+        peak_occupancy, num_dead, num_recovered = forecast.estimate_headline_numbers(
+            self.service.country_data[country], self.get_contact_rate()
+        )
+        self.write_json(
+            {
+                "peak_hospitalization": peak_occupancy,
+                "dead": num_dead,
+                "recovered": num_recovered,
+            }
+        )
+
+
+class AgeBreakdownHandler(_JSONHandler):
+    async def get(self):
+        country = self.get_country(self.get_argument("country"))
+        self.write_json(
+            await self.service.run(
+                _compute_age_breakdown, country, self.get_contact_rate()
+            )
+        )
+
+
+def make_app(service):
+    kwargs = dict(service=service)
+    return tornado.web.Application(
+        [
+            (r"/countries", CountriesHandler, kwargs),
+            (r"/countries/(.+)", CountryHandler, kwargs),
+            (r"/forecast", ForecastHandler, kwargs),
+            (r"/headline", HeadlineHandler, kwargs),
+            (r"/age_breakdown", AgeBreakdownHandler, kwargs),
+        ]
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", 8080)))
+    parser.add_argument(
+        "--workers", type=int, default=None, help="Simulation processes, defaults to the number of cores."
+    )
+    args = parser.parse_args()
+
+    service = ForecastService(ProcessPoolExecutor(max_workers=args.workers))
+    service.refresh()
+
+    # Check for fresh data in the background, as the app does on each run
+    refresh_executor = ThreadPoolExecutor(max_workers=1)
+    tornado.ioloop.PeriodicCallback(
+        lambda: refresh_executor.submit(service.refresh),
+        _DATA_REFRESH_PERIOD.total_seconds() * 1000,
+    ).start()
+
+    make_app(service).listen(args.port)
+    print(f"Serving forecasts on port {args.port}")
+    tornado.ioloop.IOLoop.current().start()
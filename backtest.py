@@ -0,0 +1,173 @@
+"""
+Backtest the forecasts against what happened next.
+
+    python backtest.py --every 7 --horizons 7 14 28
+
+For every as-of date, the daily reports up to that date are run through the same ETL stage as the published data
+(`data.utils.get_as_of_data_object`), which gives a snapshot of the country data as it was then, versioned by its
+content. Forecasts with the default contact rates are made from every (country, as-of date) pair across a process
+pool, and compared to the confirmed cases and deaths reported `--horizons` days later. Calibrated parameters aren't
+used, since they were fitted to the whole history.
+
+Forecasts are checkpointed to `--checkpoint`, keyed by as-of date and snapshot version, so reruns only compute the
+forecasts of new dates, or of dates whose reports were revised. Scoring is cheap and redone on every run, so earlier
+forecasts are scored against newly observed outcomes as well. The error table is written to `--output`.
+"""
+
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import forecast
+from data import constants, etl
+from data.table import CountryTable
+from data.utils import get_as_of_data_object, get_data_locally_or_download
+
+_MIN_CONFIRMED = 100  # Only backtest countries with at least this many confirmed cases on the as-of date
+_HORIZONS = [7, 14, 28]
+_CHECKPOINT_DTYPES = {
+    "As Of": "datetime64[ns]",
+    "Version": str,
+    "Country/Region": str,
+    "Horizon": int,
+    "Predicted Confirmed": float,
+    "Predicted Deaths": float,
+}
+
+
+def get_as_of_snapshots(full_disease_data, as_of_dates):
+    """
+    :param full_disease_data: Full table of the daily reports, see `data.utils.get_full_and_latest_dataframes`.
+    :return: Dict {as-of date: `CountryTable` of the data as it was on that date}. Each table's `version` identifies
+        its content.
+    """
+    snapshots = {}
+    for as_of_date in as_of_dates:
+        data_object = etl.run(get_as_of_data_object(full_disease_data, as_of_date))
+        snapshots[as_of_date] = CountryTable.from_dataframe(data_object["country_table"])
+    return snapshots
+
+
+def forecast_country(country_data, horizons):
+    """
+    :param country_data: `CountryRecord` of a single country, as of the date to forecast from.
+    :return: Arrays of the forecast cumulative confirmed cases and deaths, `horizons` days later.
+    """
+    df, _ = forecast.get_forecast(country_data, constants.AverageDailyContacts.default)
+    forecasts = {
+        status: df.loc[df.Status == status, "Forecast"].to_numpy()
+        for status in ["Susceptible", "Dead"]
+    }
+    # Forecasts stop once they no longer change
+    days = np.minimum(horizons, len(forecasts["Dead"]) - 1)
+    ever_infected = country_data.population - forecasts["Susceptible"][days]
+    return country_data.reporting_rate * ever_infected, forecasts["Dead"][days]
+
+
+def _forecast_job(job):
+    as_of_date, version, country_data, horizons = job
+    try:
+        predicted_confirmed, predicted_deaths = forecast_country(country_data, horizons)
+    except ValueError as e:
+        # e.g. forecasts where nothing ever changes
+        print(f"Skipping {country_data.name} as of {as_of_date:%Y-%m-%d}: {e}")
+        return []
+    return [
+        (as_of_date, version, country_data.name, horizon, confirmed, deaths)
+        for horizon, confirmed, deaths in zip(horizons, predicted_confirmed, predicted_deaths)
+    ]
+
+
+def _read_checkpoint(path):
+    if path is None or not os.path.exists(path):
+        return pd.DataFrame(columns=list(_CHECKPOINT_DTYPES)).astype(_CHECKPOINT_DTYPES)
+    return pd.read_csv(path, parse_dates=["As Of"], dtype={"Version": str})
+
+
+def _write_checkpoint(forecasts, path):
+    tmp_path = f"{path}.tmp"
+    forecasts.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+
+def run_forecasts(snapshots, horizons=_HORIZONS, checkpoint_path=None, max_workers=None):
+    """
+    Forecast from every country of every snapshot, in parallel across processes, reusing checkpointed forecasts.
+    :param snapshots: Dict {as-of date: `CountryTable`}, see `get_as_of_snapshots`.
+    :param checkpoint_path: Optional CSV file of the forecasts already made, updated after each as-of date.
+    :return: DataFrame with a row per country, as-of date and horizon, in the columns of the checkpoint.
+    """
+    forecasts = _read_checkpoint(checkpoint_path)
+    done = set(zip(forecasts["As Of"], forecasts["Version"]))
+    # Keep the forecasts of snapshots that are still current
+    current = {(as_of_date, snapshot.version) for as_of_date, snapshot in snapshots.items()}
+    forecasts = forecasts[[key in current for key in zip(forecasts["As Of"], forecasts["Version"])]]
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for as_of_date, snapshot in sorted(snapshots.items()):
+            if (as_of_date, snapshot.version) in done:
+                continue
+            confirmed = snapshot.column("Confirmed")
+            jobs = [
+                (as_of_date, snapshot.version, snapshot[country], horizons)
+                for country, num_confirmed in zip(snapshot.countries, confirmed)
+                if num_confirmed >= _MIN_CONFIRMED
+            ]
+            rows = [row for rows in executor.map(_forecast_job, jobs, chunksize=4) for row in rows]
+            forecasts = pd.concat(
+                [forecasts, pd.DataFrame(rows, columns=list(_CHECKPOINT_DTYPES))], ignore_index=True
+            ).astype(_CHECKPOINT_DTYPES)
+            if checkpoint_path is not None:
+                _write_checkpoint(forecasts, checkpoint_path)
+            print(f"Forecast {len(jobs)} countries as of {as_of_date:%Y-%m-%d}")
+
+    return forecasts
+
+
+def score(forecasts, full_disease_data):
+    """
+    Compare forecasts to what was reported on the day they forecast.
+    :param full_disease_data: Historical disease data indexed by country, as cleaned by `etl.run`.
+    :return: Error table with the forecast and observed values, and the error in log space (positive when the
+        forecast was too high), for every forecast whose outcome has been reported.
+    """
+    observed = full_disease_data.reset_index()[["Country/Region", "Date", "Confirmed", "Deaths"]]
+    errors = forecasts.assign(
+        Date=forecasts["As Of"] + pd.to_timedelta(forecasts["Horizon"], unit="D")
+    ).merge(observed, on=["Country/Region", "Date"])
+    for column in ["Confirmed", "Deaths"]:
+        errors[f"{column} Log Error"] = np.log1p(errors[f"Predicted {column}"]) - np.log1p(
+            errors[column]
+        )
+    return errors.rename(columns={"Confirmed": "Observed Confirmed", "Deaths": "Observed Deaths"})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--every", type=int, default=7, help="Days between as-of dates.")
+    parser.add_argument("--horizons", type=int, nargs="+", default=_HORIZONS)
+    parser.add_argument("--checkpoint", default="backtest_forecasts.csv")
+    parser.add_argument("--output", default="backtest_errors.csv")
+    parser.add_argument(
+        "--workers", type=int, default=None, help="Simulation processes, defaults to the number of cores."
+    )
+    args = parser.parse_args()
+
+    full_disease_data = get_data_locally_or_download()["full_table"]
+    dates = sorted(full_disease_data["Date"].unique())
+    # Counted from the first report, so that the dates backtested stay the same as new reports come in
+    as_of_dates = [pd.Timestamp(date) for date in dates[:: args.every]]
+
+    snapshots = get_as_of_snapshots(full_disease_data, as_of_dates)
+    forecasts = run_forecasts(snapshots, args.horizons, args.checkpoint, args.workers)
+    errors = score(forecasts, etl.add_derived_metrics(etl.apply_country_aliases(full_disease_data)))
+    errors.to_csv(args.output, index=False)
+
+    summary = errors.groupby("Horizon")[["Confirmed Log Error", "Deaths Log Error"]].agg(
+        lambda error: np.median(np.abs(error))
+    )
+    print(f"Median absolute log error of {len(errors)} forecasts, by horizon in days:")
+    print(summary.round(3))
@@ -0,0 +1,77 @@
+"""
+Load test for the JSON API (api.py), which must already be running.
+
+    python benchmarks/api_load_test.py --url http://localhost:8080 --concurrency 16 --requests 500
+
+Sends forecast requests for random countries and contact rates from `--concurrency` concurrent clients and reports
+throughput and latency percentiles. Use `--distinct` to control how many different queries are drawn from, and so
+how often concurrent requests can be coalesced by the server.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from urllib.parse import urlencode
+
+from tornado.httpclient import AsyncHTTPClient
+
+
+def _percentile(sorted_values, percent):
+    index = min(int(round(percent / 100 * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+async def _run(url, concurrency, num_requests, num_distinct, seed):
+    AsyncHTTPClient.configure(None, max_clients=concurrency)
+    client = AsyncHTTPClient()
+
+    countries = json.loads((await client.fetch(f"{url}/countries")).body)["countries"]
+    rng = random.Random(seed)
+    queries = [
+        dict(
+            country=rng.choice(countries),
+            asymptomatic_contacts=rng.randint(0, 50),
+            symptomatic_contacts=rng.randint(0, 50),
+        )
+        for _ in range(num_distinct)
+    ]
+    requests = [f"{url}/forecast?{urlencode(rng.choice(queries))}" for _ in range(num_requests)]
+
+    latencies = []
+    errors = 0
+
+    async def worker():
+        nonlocal errors
+        while requests:
+            request = requests.pop()
+            start = time.perf_counter()
+            response = await client.fetch(request, raise_error=False, request_timeout=300)
+            latencies.append(time.perf_counter() - start)
+            errors += response.code != 200
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    print(f"{num_requests} requests, {concurrency} concurrent clients, {num_distinct} distinct queries")
+    print(f"Throughput: {num_requests / elapsed:.1f} requests/s")
+    print(f"Latency p50: {1000 * _percentile(latencies, 50):.0f} ms")
+    print(f"Latency p99: {1000 * _percentile(latencies, 99):.0f} ms")
+    print(f"Errors: {errors}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--url", default="http://localhost:8080")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--distinct", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    asyncio.get_event_loop().run_until_complete(
+        _run(args.url, args.concurrency, args.requests, args.distinct, args.seed)
+    )
@@ -0,0 +1,243 @@
+"""
+Load test for the app: simulates concurrent Streamlit sessions, each running the per-interaction pipeline of
+`run_app` in corona-calculator.py.
+
+    python benchmarks/app_load_test.py --concurrency 1 2 4 8 16 --interactions 20
+
+Like Streamlit, which reruns the script of each session in its own thread of a single server process, every simulated
+session is a thread. A session picks a random country, then moves the sliders or changes country at random, and each
+interaction runs the country lookup, true cases estimate, historical data figure, model construction, forecast, age
+breakdown and figures of the app. Country and historical data are local stand-ins built from the demographic data
+shipped in data/, so no network access is needed. The comparison with other countries isn't run, as it is only shown
+when users select countries to compare with.
+
+With --drag, sessions move a slider one step at a time instead of jumping to a random value, and with --prefetch they
+go through the scenario cache and prefetch the neighboring scenarios like the app, see `scenario.NeighborPrefetcher`.
+
+For each level of concurrency, reports throughput, p50/p95/p99 latency per interaction and the peak resident memory
+of the process so far.
+"""
+
+import argparse
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+import types
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+# Otherwise scenarios computed by earlier runs would be read from the cache on disk instead of computed
+os.environ["CORONA_CALCULATOR_RESULT_CACHE_DIR"] = tempfile.mkdtemp()
+
+import forecast
+import graphing
+import models
+import scenario
+from data import constants, etl
+from data.constants import SymptomState
+from data.table import CountryTable, FIELDS
+
+_CHANGE_COUNTRY_PROBABILITY = 0.1
+
+
+def _percentile(sorted_values, percent):
+    index = min(int(round(percent / 100 * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def get_local_country_data(seed=0):
+    """
+    Stand-in for the published country data: real populations and hospital beds, with made up case counts.
+    :return: `CountryTable`.
+    """
+    rng = np.random.RandomState(seed)
+    df = etl.join_demographic_data()
+    df = df.loc[~df.index.duplicated() & df["Num Hospital Beds"].notna()].copy()
+    df["Confirmed"] = np.round(df.Population * 10 ** rng.uniform(-6, -3, len(df))) + 10
+    df["Deaths"] = np.round(df.Confirmed * rng.uniform(0, 0.05, len(df)))
+    df["Recovered"] = np.round(df.Confirmed * rng.uniform(0, 0.5, len(df)))
+    df["Reporting Rate"] = constants.ReportingRate.default
+    df["Transmission Rate Per Contact"] = constants.TransmissionRatePerContact.default
+    df["Calibration Loss"] = np.nan
+    df["Infections Estimated From Deaths"] = np.nan
+    return CountryTable.from_dataframe(df[list(FIELDS)])
+
+
+def get_local_historical_data(country_table, num_days=60):
+    """
+    Stand-in for the published historical data: exponential growth up to the latest numbers of each country.
+    :return: Dict {country: DataFrame of the columns of the historical data plotted by the app}.
+    """
+    dates = pd.date_range(end="2020-04-01", periods=num_days)
+    growth = np.geomspace(1e-3, 1, num_days)
+    historical_data = {}
+    for country in country_table:
+        country_data = country_table[country]
+        historical_data[country] = pd.DataFrame(
+            {
+                "Date": dates,
+                "Confirmed": np.round(country_data.confirmed * growth),
+                "Deaths": np.round(country_data.deaths * growth),
+                "Recovered": np.round(country_data.recovered * growth),
+            }
+        )
+    return historical_data
+
+
+def run_interaction(country_table, historical_data, country, contact_rate, prefetcher=None):
+    """
+    Everything `run_app` computes for one set of inputs, without rendering. Pre-rendered default scenarios aren't
+    used, as if every user had moved a slider.
+    :param historical_data: Dict {country: historical data}, see `get_local_historical_data`.
+    :param prefetcher: Optional `scenario.NeighborPrefetcher` of the session. Without one, scenarios aren't cached.
+    """
+    country_data = country_table[country]
+    estimated_true_cases = forecast.get_true_cases_estimator(country_data).predict(country_data.confirmed)
+    models.get_probability_of_infection_give_asymptomatic(
+        country_data.population, estimated_true_cases, constants.AsymptomaticRate.default
+    )
+    graphing.plot_historical_data(historical_data[country])
+
+    if prefetcher is None:
+        forecast.estimate_headline_numbers(country_data, contact_rate)
+        scenario.get_scenario(country_data, contact_rate)
+    else:
+        # Stands in for `data.countries.Countries`
+        countries = types.SimpleNamespace(version=country_table.version, country_data=country_table)
+        if scenario.get_cached_scenario(countries, country, contact_rate, compute=False) is None:
+            forecast.estimate_headline_numbers(country_data, contact_rate)
+            scenario.get_cached_scenario(countries, country, contact_rate)
+        prefetcher.prefetch(countries, country, contact_rate)
+
+
+def _move_slider(contact_rate, drag, rng):
+    state = rng.choice(list(SymptomState))
+    if drag:
+        contact_rate[state] = min(
+            max(contact_rate[state] + rng.choice([-1, 1]), constants.AverageDailyContacts.min),
+            constants.AverageDailyContacts.max,
+        )
+    else:
+        contact_rate[state] = rng.randint(
+            constants.AverageDailyContacts.min, constants.AverageDailyContacts.max
+        )
+
+
+def _run_session(
+    country_table, historical_data, num_interactions, think_time, drag, prefetch, rng, latencies
+):
+    country = rng.choice(country_table.countries)
+    contact_rate = dict(constants.AverageDailyContacts.default)
+    prefetcher = scenario.NeighborPrefetcher() if prefetch else None
+
+    for _ in range(num_interactions):
+        start = time.perf_counter()
+        run_interaction(country_table, historical_data, country, contact_rate, prefetcher)
+        latencies.append(time.perf_counter() - start)
+
+        if rng.random() < _CHANGE_COUNTRY_PROBABILITY:
+            country = rng.choice(country_table.countries)
+        else:
+            _move_slider(contact_rate, drag, rng)
+        if think_time:
+            time.sleep(rng.expovariate(1 / think_time))
+
+
+def run_load_test(
+    country_table,
+    historical_data,
+    concurrency,
+    num_interactions,
+    think_time=0,
+    drag=False,
+    prefetch=False,
+    seed=0,
+):
+    """
+    Run `concurrency` sessions of `num_interactions` interactions each, all at the same time.
+    :param historical_data: Dict {country: historical data}, see `get_local_historical_data`.
+    :param think_time: Mean number of seconds a user waits between interactions.
+    :param drag: Whether sessions move sliders one step at a time.
+    :param prefetch: Whether sessions cache scenarios and prefetch their neighbors, like the app.
+    :return: Dict of the statistics reported.
+    """
+    latencies = []
+    sessions = [
+        threading.Thread(
+            target=_run_session,
+            args=(
+                country_table,
+                historical_data,
+                num_interactions,
+                think_time,
+                drag,
+                prefetch,
+                random.Random(seed + i),
+                latencies,
+            ),
+        )
+        for i in range(concurrency)
+    ]
+
+    start = time.perf_counter()
+    for session in sessions:
+        session.start()
+    for session in sessions:
+        session.join()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "interactions": len(latencies),
+        "throughput": len(latencies) / elapsed,
+        "p50": _percentile(latencies, 50),
+        "p95": _percentile(latencies, 95),
+        "p99": _percentile(latencies, 99),
+        # Kilobytes on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--interactions", type=int, default=20, help="Interactions per session.")
+    parser.add_argument(
+        "--think-time", type=float, default=0, help="Mean seconds between interactions of a session."
+    )
+    parser.add_argument(
+        "--drag", action="store_true", help="Move sliders one step at a time."
+    )
+    parser.add_argument(
+        "--prefetch", action="store_true", help="Cache scenarios and prefetch their neighbors."
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    country_table = get_local_country_data(args.seed)
+    historical_data = get_local_historical_data(country_table)
+    # Warm up imports and caches, as a long running server would be
+    run_interaction(country_table, historical_data, "Canada", constants.AverageDailyContacts.default)
+
+    print(f"{'Sessions':>8} {'Interactions/s':>15} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'Peak RSS MB':>12}")
+    for concurrency in args.concurrency:
+        stats = run_load_test(
+            country_table,
+            historical_data,
+            concurrency,
+            args.interactions,
+            args.think_time,
+            args.drag,
+            args.prefetch,
+            args.seed,
+        )
+        print(
+            f"{concurrency:>8} {stats['throughput']:>15.1f} {1000 * stats['p50']:>8.0f} "
+            f"{1000 * stats['p95']:>8.0f} {1000 * stats['p99']:>8.0f} {stats['peak_rss_mb']:>12.0f}"
+        )
@@ -0,0 +1,140 @@
+"""
+Compare the two ways `forecast.get_comparison_forecast` can forecast several countries: one batched simulation, or
+one `forecast.get_forecast` per country.
+
+    python benchmarks/comparison_forecast.py --repeat 5
+
+Runs in two subprocesses, one with CORONA_CALCULATOR_DISABLE_JIT set, and prints the fastest time of each way for
+each number of countries. Exits with an error if the two ways give different peak hospital occupancies.
+
+Without the compiled kernel, the numpy batch pays the overhead of its numpy calls on every day of the simulation,
+however small the batch. With the versions of runtime.txt and requirements.txt (Python 3.7, numpy 1.18, pandas 1.0),
+it prints for example:
+
+    == numpy
+    Countries       Batch ms  One by one ms
+    1                    109             30
+    2                     96             58
+    5                     88            176
+    10                   100            344
+    20                   118            640
+    numba is not installed, no timings of the compiled kernel
+
+With the compiled kernel, the batch takes under a millisecond, and is always faster.
+"""
+
+import argparse
+import os
+import pickle
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import forecast
+from data.constants import SymptomState
+from data.table import FIELDS, CountryTable
+
+_BATCH_SIZES = [1, 2, 5, 10, 20]
+# Population, confirmed cases, num hospital beds
+_AREAS = [(1e5, 100, 300), (5e6, 1000, 1.5e4), (3.7e7, 3e4, 1e5), (1.4e9, 8e4, 6e6)]
+_CONTACT_RATE = {SymptomState.ASYMPTOMATIC: 5, SymptomState.SYMPTOMATIC: 2}
+
+
+def _get_country_table(num_countries):
+    areas = [_AREAS[i % len(_AREAS)] for i in range(num_countries)]
+    population, confirmed, num_hospital_beds = (np.array(values, dtype=float) for values in zip(*areas))
+    columns = {field: np.full(num_countries, np.nan) for field in FIELDS}
+    columns.update(
+        {
+            "Confirmed": confirmed,
+            "Deaths": confirmed / 50,
+            "Recovered": confirmed / 10,
+            "Population": population,
+            "Num Hospital Beds": num_hospital_beds,
+            "Reporting Rate": np.linspace(0.1, 0.3, num_countries),
+            "Transmission Rate Per Contact": np.full(num_countries, 0.02),
+        }
+    )
+    return CountryTable([f"Country {i}" for i in range(num_countries)], columns)
+
+
+def _time(function, repeat):
+    seconds = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        seconds = min(seconds, time.perf_counter() - start)
+    return seconds, result
+
+
+def _run_benchmark(repeat):
+    """
+    :return: Dict {number of countries: (batch seconds, one by one seconds, whether the peaks are the same)}.
+    """
+    # Compile outside of the timings
+    forecast._get_batch_predictions(_get_country_table(1).column, _CONTACT_RATE)
+
+    timings = {}
+    for num_countries in _BATCH_SIZES:
+        country_table = _get_country_table(num_countries)
+        batch_seconds, batch = _time(
+            lambda: forecast._get_batch_predictions(country_table.column, _CONTACT_RATE), repeat
+        )
+        one_by_one_seconds, one_by_one = _time(
+            lambda: forecast._get_predictions_one_by_one(country_table, country_table.countries, _CONTACT_RATE),
+            repeat,
+        )
+        same_peaks = np.array_equal(
+            batch["Need Hospitalization"].max(axis=1), one_by_one["Need Hospitalization"].max(axis=1)
+        )
+        timings[num_countries] = batch_seconds, one_by_one_seconds, same_peaks
+    return timings
+
+
+def _run_subprocess(disable_jit, repeat):
+    env = dict(os.environ)
+    env.pop("CORONA_CALCULATOR_DISABLE_JIT", None)
+    if disable_jit:
+        env["CORONA_CALCULATOR_DISABLE_JIT"] = "1"
+    output = subprocess.run(
+        [sys.executable, __file__, "--worker", "--repeat", str(repeat)],
+        env=env,
+        stdout=subprocess.PIPE,
+        check=True,
+    ).stdout
+    return pickle.loads(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per measurement, the fastest is kept.")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        timings = _run_benchmark(args.repeat)
+        pickle.dump((timings, forecast.sir_kernel.get_kernel() is not None), sys.stdout.buffer)
+        return
+
+    mismatches = []
+    for disable_jit in [True, False]:
+        timings, compiled = _run_subprocess(disable_jit, args.repeat)
+        if not disable_jit and not compiled:
+            print("numba is not installed, no timings of the compiled kernel")
+            break
+        print(f"== {'Compiled kernel' if compiled else 'numpy'}")
+        print(f"{'Countries':<12}{'Batch ms':>12}{'One by one ms':>15}")
+        for num_countries, (batch_seconds, one_by_one_seconds, same_peaks) in timings.items():
+            print(f"{num_countries:<12}{batch_seconds * 1000:>12.0f}{one_by_one_seconds * 1000:>15.0f}")
+            if not same_peaks:
+                mismatches.append(num_countries)
+    if mismatches:
+        sys.exit(f"Peak hospital occupancies differ for {mismatches} countries")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+Import-time profile of the entry points of the web and release processes.
+
+    python benchmarks/import_time.py --repeat 5
+
+Each entry point is imported in a fresh interpreter with `python -X importtime`, which reports, for every module, the
+time taken to import it including the modules it imported first. For each entry point, prints the total import time
+and the cumulative time of its slowest modules (the modules of this repo and third-party packages), keeping the
+fastest of `--repeat` runs.
+
+Some heavy dependencies are only imported on the code paths that use them, e.g. boto3 when there are S3 credentials.
+The script exits with an error if an entry point imports one of the modules it should defer (see `_ENTRY_POINTS`), so
+that an import added at the top of a module shows up here.
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import sysconfig
+
+_REPO_DIRPATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+_STDLIB_DIRPATH = os.path.realpath(sysconfig.get_paths()["stdlib"])
+_SITE_PACKAGES_DIRPATH = os.path.realpath(sysconfig.get_paths()["purelib"])
+
+# Entry point: modules it shouldn't import until they are used. The app itself needs streamlit to be installed.
+_ENTRY_POINTS = {
+    "corona-calculator.py": ["boto3", "plotly.express"],
+    "data.countries": ["boto3", "plotly", "streamlit"],
+    "api": ["boto3", "plotly", "streamlit"],
+    "fetch_live_data": ["boto3", "plotly", "streamlit"],
+}
+
+_IMPORT_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+{statement}
+seconds = time.perf_counter() - start
+print(json.dumps({{"seconds": seconds, "imported": [m for m in {deferred!r} if m in sys.modules]}}))
+"""
+
+
+def _import_statement(entry_point):
+    if entry_point.endswith(".py"):
+        # Runs the module level of the script but not its __main__ block
+        return f"import runpy; runpy.run_path({entry_point!r})"
+    return f"import {entry_point}"
+
+
+def _is_stdlib(module):
+    spec = importlib.util.find_spec(module)
+    if spec is None or spec.origin is None:
+        # Namespace packages aren't part of the standard library
+        return False
+    if spec.origin in ("built-in", "frozen"):
+        return True
+    path = os.path.realpath(spec.origin)
+    # Third-party packages may be installed inside the standard library directory, e.g. in a virtualenv
+    return path.startswith(_STDLIB_DIRPATH + os.sep) and not path.startswith(_SITE_PACKAGES_DIRPATH + os.sep)
+
+
+def _is_reported(module):
+    # Third-party packages as a whole, and each module of this repo
+    top_level = module.split(".")[0]
+    if os.path.exists(os.path.join(_REPO_DIRPATH, top_level)):
+        return True
+    return "." not in module and not _is_stdlib(module)
+
+
+def _parse_importtime(stderr):
+    """
+    :return: Dict {module: cumulative import time in seconds} of the modules worth reporting.
+    """
+    cumulative = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, microseconds, module = line.split("|")
+        module = module.strip()
+        if _is_reported(module):
+            cumulative[module] = int(microseconds) / 1e6
+    return cumulative
+
+
+def profile(entry_point, deferred, repeat):
+    """
+    :return: Fastest total import time in seconds, dict {module: fastest cumulative import time} and the deferred
+        modules that were imported anyway, or None if the entry point couldn't be imported.
+    """
+    script = _IMPORT_SCRIPT.format(statement=_import_statement(entry_point), deferred=deferred)
+    total, cumulative = float("inf"), {}
+    for _ in range(repeat):
+        process = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", script],
+            cwd=_REPO_DIRPATH,
+            capture_output=True,
+            text=True,
+        )
+        if process.returncode != 0:
+            print(process.stderr.strip().splitlines()[-1])
+            return None
+        result = json.loads(process.stdout.strip().splitlines()[-1])
+        total = min(total, result["seconds"])
+        for module, seconds in _parse_importtime(process.stderr).items():
+            cumulative[module] = min(cumulative.get(module, seconds), seconds)
+    return total, cumulative, result["imported"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("entry_points", nargs="*", default=list(_ENTRY_POINTS))
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per entry point, the fastest is kept.")
+    parser.add_argument("--top", type=int, default=12, help="Number of modules reported per entry point.")
+    args = parser.parse_args()
+
+    failed = False
+    for entry_point in args.entry_points:
+        print(f"== {entry_point}")
+        results = profile(entry_point, _ENTRY_POINTS.get(entry_point, []), args.repeat)
+        if results is None:
+            failed = True
+            continue
+        total, cumulative, imported = results
+        print(f"{'Module':<40}{'Cumulative ms':>14}")
+        for module, seconds in sorted(cumulative.items(), key=lambda item: -item[1])[: args.top]:
+            print(f"{module:<40}{seconds * 1000:>14.0f}")
+        print(f"{'Total':<40}{total * 1000:>14.0f}")
+        if imported:
+            print(f"Imported modules that should be deferred: {', '.join(imported)}")
+            failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""
+Check that the compiled SIR kernel (sir_kernel.py) gives exactly the same forecasts as the pure Python models, and
+compare their speed.
+
+    python benchmarks/jit_kernel.py
+
+Runs the same forecasts in two subprocesses, one with CORONA_CALCULATOR_DISABLE_JIT set, and exits with an error if
+any forecast or summary differs. Needs numba to be installed.
+"""
+
+import argparse
+import os
+import pickle
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import forecast
+import models
+from data import constants
+from data.constants import SymptomState
+
+_CONTACT_RATES = [0, 1, 3, 5, 10, 20, 50]
+# Population, confirmed cases, num hospital beds
+_AREAS = [(1e5, 100, 300), (5e6, 1000, 1.5e4), (3.7e7, 3e4, 1e5), (1.4e9, 8e4, 6e6)]
+
+
+def _get_sir_model(contact_rate, num_hospital_beds, hospital_stay_model=None):
+    return models.AsymptomaticSIRModel(
+        transmission_rate_per_contact=constants.TransmissionRatePerContact.default_per_symptom_state,
+        contact_rate=contact_rate,
+        recovery_rate=constants.RecoveryRate.default,
+        normal_death_rate=constants.MortalityRate.default,
+        critical_death_rate=constants.CriticalDeathRate.default,
+        hospitalization_rate=constants.HospitalizationRate.default,
+        hospital_capacity=num_hospital_beds,
+        asymptomatic_cases_model=models.AsymptomaticCasesModel(constants.AsymptomaticRate.default),
+        hospital_stay_model=hospital_stay_model,
+    )
+
+
+def _run_forecasts():
+    """
+    :return: Dict of all forecasts and the time taken by each kind of forecast.
+    """
+    scenarios = [
+        (area, {SymptomState.ASYMPTOMATIC: asymptomatic, SymptomState.SYMPTOMATIC: symptomatic})
+        for area in _AREAS
+        for asymptomatic in _CONTACT_RATES
+        for symptomatic in _CONTACT_RATES
+    ]
+    true_cases_estimator = models.TrueInfectedCasesModel(constants.ReportingRate.default)
+    hospital_stay_model = forecast.get_hospital_stay_model()
+    results = {}
+    timings = {}
+
+    start = time.perf_counter()
+    for (population, confirmed, num_hospital_beds), contact_rate in scenarios:
+        results["scalar", population, str(contact_rate)] = models.get_predictions(
+            cases_estimator=true_cases_estimator,
+            sir_model=_get_sir_model(contact_rate, num_hospital_beds),
+            num_diagnosed=confirmed,
+            num_recovered=0,
+            num_deaths=0,
+            area_population=population,
+            return_summary=True,
+        )
+    timings["AsymptomaticSIRModel"] = (time.perf_counter() - start) / len(scenarios)
+
+    start = time.perf_counter()
+    for (population, confirmed, num_hospital_beds), contact_rate in scenarios:
+        results["hospital stay", population, str(contact_rate)] = models.get_predictions(
+            cases_estimator=true_cases_estimator,
+            sir_model=_get_sir_model(contact_rate, num_hospital_beds, hospital_stay_model),
+            num_diagnosed=confirmed,
+            num_recovered=0,
+            num_deaths=0,
+            area_population=population,
+            return_summary=True,
+        )
+    timings["AsymptomaticSIRModel with hospital stays"] = (time.perf_counter() - start) / len(scenarios)
+
+    later_contact_rate = {SymptomState.ASYMPTOMATIC: 5, SymptomState.SYMPTOMATIC: 2}
+    start = time.perf_counter()
+    for (population, confirmed, num_hospital_beds), contact_rate in scenarios:
+        results["schedule", population, str(contact_rate)] = models.get_predictions(
+            cases_estimator=true_cases_estimator,
+            sir_model=_get_sir_model(contact_rate, num_hospital_beds, hospital_stay_model),
+            num_diagnosed=confirmed,
+            num_recovered=0,
+            num_deaths=0,
+            area_population=population,
+            contact_rate_schedule=models.ContactRateSchedule(
+                [(0, contact_rate), (60, later_contact_rate)]
+            ),
+            return_summary=True,
+        )
+    timings["AsymptomaticSIRModel with schedule"] = (time.perf_counter() - start) / len(scenarios)
+
+    start = time.perf_counter()
+    population, confirmed, num_hospital_beds = (np.array(values) for values in zip(*_AREAS))
+    for contact_rate in _CONTACT_RATES:
+        sir_model = models.BatchSIRModel(
+            transmission_rate_per_contact=constants.TransmissionRatePerContact.default_per_symptom_state,
+            contact_rate={state: contact_rate for state in SymptomState},
+            recovery_rate=constants.RecoveryRate.default,
+            normal_death_rate=constants.MortalityRate.default,
+            critical_death_rate=constants.CriticalDeathRate.default,
+            hospitalization_rate=constants.HospitalizationRate.default,
+            hospital_capacity=num_hospital_beds,
+            asymptomatic_rate=constants.AsymptomaticRate.default,
+            hospital_stay_model=hospital_stay_model,
+        )
+        results["batch", contact_rate] = models.get_batch_predictions(
+            cases_estimator=true_cases_estimator,
+            sir_model=sir_model,
+            num_diagnosed=confirmed,
+            num_recovered=0,
+            num_deaths=0,
+            area_population=population,
+        )
+    timings[f"BatchSIRModel of {len(_AREAS)}"] = (time.perf_counter() - start) / len(_CONTACT_RATES)
+
+    return results, timings
+
+
+def _is_equal(reference, other):
+    if isinstance(reference, tuple):
+        df, summary = reference
+        other_df, other_summary = other
+        return df.equals(other_df) and summary.to_dict() == other_summary.to_dict()
+    return all(np.array_equal(reference[status], other[status]) for status in reference)
+
+
+def _run_subprocess(disable_jit):
+    env = dict(os.environ)
+    env.pop("CORONA_CALCULATOR_DISABLE_JIT", None)
+    if disable_jit:
+        env["CORONA_CALCULATOR_DISABLE_JIT"] = "1"
+    output = subprocess.run(
+        [sys.executable, __file__, "--worker"], env=env, stdout=subprocess.PIPE, check=True
+    ).stdout
+    return pickle.loads(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        # Compile outside of the timings
+        _run_forecasts()
+        results, timings = _run_forecasts()
+        pickle.dump((results, timings, "numba" in sys.modules), sys.stdout.buffer)
+        return
+
+    reference, reference_timings, numba_imported = _run_subprocess(disable_jit=True)
+    assert not numba_imported, "numba was imported with the compiled kernel disabled"
+    compiled, compiled_timings, numba_imported = _run_subprocess(disable_jit=False)
+    if not numba_imported:
+        sys.exit("numba is not installed, nothing to compare")
+
+    mismatches = [key for key in reference if not _is_equal(reference[key], compiled[key])]
+    print(f"{len(reference) - len(mismatches)}/{len(reference)} forecasts identical")
+    for name, reference_time in reference_timings.items():
+        print(
+            f"{name}: {1000 * reference_time:.2f} ms in Python, {1000 * compiled_timings[name]:.2f} ms compiled "
+            f"({reference_time / compiled_timings[name]:.0f}x)"
+        )
+    if mismatches:
+        sys.exit(f"Forecasts differ: {mismatches}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""
+Fit per-country reporting and transmission rates to the historical case and death series.
+
+For each country we simulate the period covered by the historical data with `models.BatchSIRModel`, evaluating a
+whole grid of candidate (reporting rate, transmission rate per contact) pairs in a single batch, then zoom the grid in
+around the best candidate. Countries are calibrated in parallel across cores. This runs as part of fetch_live_data.py
+so the fitted parameters ship with the data and the app never has to refit.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import forecast
+import models
+from data import constants
+
+_MIN_CONFIRMED = 100  # Start fitting once a country has this many confirmed cases
+_MIN_DAYS = 14  # Don't fit countries with less history than this
+_CANDIDATES_PER_AXIS = 16
+_NUM_ITERATIONS = 4
+
+CALIBRATION_COLUMNS = ["Reporting Rate", "Transmission Rate Per Contact", "Calibration Loss"]
+
+
+def _simulate_candidates(
+    reporting_rates, transmission_rates, confirmed, recovered, deaths, population, hospital_capacity, num_days
+):
+    """
+    Simulate every candidate pair from the same starting point as `models.get_predictions`.
+    :return: Model-implied cumulative diagnosed cases and deaths, arrays of shape (num candidates, num_days + 1), which
+        start from the observed `confirmed` and `deaths`.
+    """
+    sir_model = models.BatchSIRModel(
+        transmission_rate_per_contact=models.get_transmission_rate_per_symptom_state(transmission_rates),
+        contact_rate=constants.AverageDailyContacts.default,
+        recovery_rate=constants.RecoveryRate.default,
+        normal_death_rate=constants.MortalityRate.default,
+        critical_death_rate=constants.CriticalDeathRate.default,
+        hospitalization_rate=constants.HospitalizationRate.of_reported_cases * reporting_rates,
+        hospital_capacity=hospital_capacity,
+        asymptomatic_rate=constants.AsymptomaticRate.default,
+        hospital_stay_model=forecast.get_hospital_stay_model(),
+    )
+    true_cases = confirmed / reporting_rates
+    predictions = sir_model.predict(
+        susceptible=population - true_cases - recovered - deaths,
+        infected=true_cases,
+        recovered=recovered,
+        dead=deaths,
+        num_days=num_days,
+    )
+    # The model was seeded with the confirmed cases, so those are the diagnosed cases on day 0, and only the people
+    # infected since are diagnosed at the reporting rate. Counting everyone who ever left the susceptible compartment
+    # would also count the reported recovered and dead a second time.
+    newly_infected = predictions["Susceptible"][:, :1] - predictions["Susceptible"]
+    return confirmed + reporting_rates[:, None] * newly_infected, predictions["Dead"]
+
+
+def _loss(predicted, observed):
+    """Mean squared error in log space, so that countries and epidemic phases of any size weigh the same."""
+    return np.mean((np.log1p(np.maximum(predicted, 0)) - np.log1p(observed)) ** 2, axis=-1)
+
+
+def calibrate_country(history, population, hospital_capacity):
+    """
+    Fit the reporting rate and transmission rate per contact of a single country.
+    :param history: Historical data of the country, with Date, Confirmed, Deaths and Recovered columns.
+    :param population: Population of the country.
+    :param hospital_capacity: Number of hospital beds in the country.
+    :return: Dict with the fitted parameters and the loss, or None if there is not enough history to fit, or no
+        candidate fits it, e.g. because of missing counts.
+    """
+    if not np.isfinite(hospital_capacity):
+        return None
+
+    history = history.sort_values("Date")
+    history = history.loc[history.Confirmed >= _MIN_CONFIRMED]
+    if len(history) < _MIN_DAYS:
+        return None
+
+    days = (history.Date - history.Date.iloc[0]).dt.days.values
+    confirmed, deaths, recovered = (
+        history[column].values.astype(float) for column in ["Confirmed", "Deaths", "Recovered"]
+    )
+
+    # Search in log space: both parameters span more than an order of magnitude
+    bounds = np.log(
+        [
+            [constants.ReportingRate.min, constants.ReportingRate.max],
+            [constants.TransmissionRatePerContact.min, constants.TransmissionRatePerContact.max],
+        ]
+    )
+    for _ in range(_NUM_ITERATIONS):
+        log_reporting_rates, log_transmission_rates = (
+            np.linspace(low, high, _CANDIDATES_PER_AXIS) for low, high in bounds
+        )
+        grid = np.exp(np.array(np.meshgrid(log_reporting_rates, log_transmission_rates)).reshape(2, -1))
+        predicted_confirmed, predicted_deaths = _simulate_candidates(
+            grid[0],
+            grid[1],
+            confirmed[0],
+            recovered[0],
+            deaths[0],
+            population,
+            hospital_capacity,
+            num_days=days[-1],
+        )
+        losses = _loss(predicted_confirmed[:, days], confirmed) + _loss(predicted_deaths[:, days], deaths)
+        if np.isnan(losses).all():
+            return None
+        best = np.nanargmin(losses)
+
+        # Zoom in to one grid step either side of the best candidate
+        steps = (bounds[:, 1] - bounds[:, 0]) / (_CANDIDATES_PER_AXIS - 1)
+        best_log = np.log(grid[:, best])
+        bounds = np.stack([best_log - steps, best_log + steps], axis=1)
+
+    return {
+        "Reporting Rate": grid[0, best],
+        "Transmission Rate Per Contact": grid[1, best],
+        "Calibration Loss": losses[best],
+    }
+
+
+def _calibrate_country_job(job):
+    country, history, population, hospital_capacity = job
+    return country, calibrate_country(history, population, hospital_capacity)
+
+
+def calibrate_countries(full_disease_data, demographic_data, max_workers=None):
+    """
+    Calibrate every country present in both tables, in parallel across processes.
+    :param full_disease_data: Historical disease data indexed by country, as in the "full_table" of the data object.
+    :param demographic_data: Population and bed data indexed by country, see `data.etl.join_demographic_data`.
+    :param max_workers: Number of worker processes, defaults to the number of cores.
+    :return: DataFrame of fitted parameters indexed by country. Countries that could not be fitted are left out.
+    """
+    countries = sorted(set(full_disease_data.index.unique()) & set(demographic_data.index))
+    jobs = [
+        (
+            country,
+            full_disease_data.loc[[country], ["Date", "Confirmed", "Deaths", "Recovered"]],
+            demographic_data.loc[country, "Population"],
+            demographic_data.loc[country, "Num Hospital Beds"],
+        )
+        for country in countries
+    ]
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        results = dict(executor.map(_calibrate_country_job, jobs))
+
+    fitted = {country: result for country, result in results.items() if result is not None}
+    calibration = pd.DataFrame.from_dict(fitted, orient="index", columns=CALIBRATION_COLUMNS)
+    calibration.index.name = "Country/Region"
+    return calibration
@@ -1,7 +1,11 @@
+import math
+
 import streamlit as st
 
+import forecast
 import graphing
 import models
+import scenario
 import utils
 from data import constants
 from data.constants import NOTION_MODELLING_DOC, MEDIUM_BLOGPOST
@@ -16,12 +20,10 @@ def run_app():
     css.hide_menu()
     css.limit_plot_size()
 
-    # Get cached country data
+    # Get country data shared across processes, refreshed when stale
     countries = fetch_country_data()
-
-    if countries.stale:
-        st.caching.clear_cache()
-        countries = fetch_country_data()
+    # Scenarios users looked at before this process started, e.g. before a restart
+    scenario.warm_up_cache(countries)
 
     st.markdown(
         body=generate_html(text=f"Corona Calculator", bold=True, tag="h1"),
@@ -59,27 +61,36 @@ def run_app():
     sidebar = Sidebar(countries)
     country = sidebar.country
     country_data = countries.country_data[country]
-    _historical_df = countries.historical_country_data
-    historical_data = _historical_df.loc[_historical_df.index == country]
-    number_cases_confirmed = country_data["Confirmed"]
-    population = country_data["Population"]
-    num_hospital_beds = country_data["Num Hospital Beds"]
+    historical_data = countries.historical_data(country)
+    number_cases_confirmed = country_data.confirmed
+    population = country_data.population
+    num_hospital_beds = country_data.num_hospital_beds
 
     st.subheader(f"How has the disease spread in {country}?")
     st.write(
         "The number of reported cases radically underestimates the true cases, because people do not show symptoms for "
         "several days, not everybody gets tested, and the tests take a few days to return results. "
         "The extent depends upon your country's testing strategy."
-        " This estimate (14% reporting) is from China ([source](https://science.sciencemag.org/content/early/2020/03/13/science.abb3221))."
+        + (
+            f" This estimate ({country_data.reporting_rate:.0%} reporting) was fitted to the cases and deaths reported in {country}."
+            if country_data.is_calibrated
+            else " This estimate (14% reporting) is from China ([source](https://science.sciencemag.org/content/early/2020/03/13/science.abb3221))."
+        )
     )
     # Estimate true cases
-    true_cases_estimator = models.TrueInfectedCasesModel(
-        constants.ReportingRate.default
-    )
+    true_cases_estimator = forecast.get_true_cases_estimator(country_data)
     estimated_true_cases = true_cases_estimator.predict(number_cases_confirmed)
 
     reported_vs_true_cases(int(number_cases_confirmed), estimated_true_cases)
 
+    infections_estimated_from_deaths = country_data.infections_estimated_from_deaths
+    if not math.isnan(infections_estimated_from_deaths):
+        st.write(
+            f"Going by the **{int(country_data.deaths):,}** deaths reported instead, and the few weeks it takes for "
+            f"an infection to turn fatal, around **{int(infections_estimated_from_deaths):,}** people have been "
+            f"infected so far ({infections_estimated_from_deaths / population:.2%} of the population)."
+        )
+
     st.markdown(
         f"Given the prevalence of the infection in your country, the probability of being infected at this time is "
         f"**{estimated_true_cases / population:.3%}**. Even if you show no symptoms, the probability of being infected is "
@@ -91,30 +102,53 @@ def run_app():
     fig = graphing.plot_historical_data(historical_data)
     st.write(fig)
 
-    asymptomatic_cases_estimator = models.AsymptomaticCasesModel(
-        constants.AsymptomaticRate.default
-    )
+    # Derived metrics were computed for all countries when the data was published
+    if len(historical_data) and not math.isnan(
+        historical_data["New Confirmed (7-Day Average)"].iloc[-1]
+    ):
+        latest = historical_data.iloc[-1]
+        st.markdown(
+            f"Over the last week, an average of **{int(latest['New Confirmed (7-Day Average)']):,}** new cases and "
+            f"**{int(latest['New Deaths (7-Day Average)']):,}** deaths were reported each day, and "
+            f"**{int(latest['Active']):,}** cases are still active."
+            + (
+                f" At the current rate, the number of new cases doubles every "
+                f"**{latest['Case Doubling Time']:.1f}** days."
+                if not math.isnan(latest["Case Doubling Time"])
+                else ""
+            )
+        )
 
     contact_rate = sidebar.contact_rate
 
-    asymptomatic_sir_model = models.AsymptomaticSIRModel(
-        transmission_rate_per_contact=constants.TransmissionRatePerContact.default_per_symptom_state,
-        contact_rate=contact_rate,
-        asymptomatic_cases_model=asymptomatic_cases_estimator,
-        recovery_rate=constants.RecoveryRate.default,
-        normal_death_rate=constants.MortalityRate.default,
-        critical_death_rate=constants.CriticalDeathRate.default,
-        hospitalization_rate=constants.HospitalizationRate.default,
-        hospital_capacity=num_hospital_beds
-    )
-
-    df = models.get_predictions(
-        cases_estimator=true_cases_estimator,
-        sir_model=asymptomatic_sir_model,
-        num_diagnosed=number_cases_confirmed,
-        num_recovered=country_data["Recovered"],
-        num_deaths=country_data["Deaths"],
-        area_population=population,
+    # Until the user changes an input, serve the scenario rendered when the data was published, or else one already
+    # computed by this process, if only while prefetching the neighbors of a scenario served earlier
+    page = None
+    if sidebar.contact_rate_schedule is None:
+        if contact_rate == constants.AverageDailyContacts.default:
+            page = scenario.get_default_scenario(countries, country)
+        if page is None:
+            page = scenario.get_cached_scenario(countries, country, contact_rate, compute=False)
+
+    headline = st.empty()
+    if page is None:
+        if sidebar.contact_rate_schedule is None:
+            # Show a quick estimate of the outcome while the full simulation runs
+            approx_peak_occupancy, approx_num_dead, _ = forecast.estimate_headline_numbers(
+                country_data, contact_rate
+            )
+            headline.info(
+                f"With the selected behavior, roughly **{int(approx_num_dead):,}** people will die, and up to "
+                f"**{int(approx_peak_occupancy):,}** will need a hospital bed at the same time."
+            )
+            page = scenario.get_cached_scenario(countries, country, contact_rate)
+        else:
+            page = scenario.get_scenario(country_data, contact_rate, sidebar.contact_rate_schedule)
+
+    peak_occupancy, num_dead, summary = page["peak_occupancy"], page["num_dead"], page["summary"]
+    headline.info(
+        f"With the selected behavior, we estimate **{int(num_dead):,}** people will die, and up to "
+        f"**{int(peak_occupancy):,}** will need a hospital bed at the same time."
     )
 
     st.subheader("How will my actions affect the spread?")
@@ -126,16 +160,26 @@ def run_app():
         "**Play with the slider to the left to see how this changes the dynamics of disease spread**"
     )
 
-    df_base = df[~df.Status.isin(["Need Hospitalization"])]
-    base_graph = graphing.infection_graph(df_base, df_base.Forecast.max(), sidebar.contact_rate)
     st.warning(graph_warning)
-    st.write(base_graph)
+    st.write(page["figures"]["infection"])
+    if sidebar.contact_rate_schedule is not None:
+        later_contact_rate = sidebar.contact_rate_schedule.contact_rates[-1]
+        st.write(
+            f"After **{sidebar.contact_rate_schedule.start_days[-1]}** days, symptomatic people meet "
+            f"**{later_contact_rate[constants.SymptomState.SYMPTOMATIC]}** and asymptomatic people meet "
+            f"**{later_contact_rate[constants.SymptomState.ASYMPTOMATIC]}** people a day."
+        )
 
     st.subheader("How will this affect my healthcare system?")
     st.write(
         "The important variable for hospitals is the peak number of people who require hospitalization"
         " and ventilation at any one time."
     )
+    st.write(
+        f"We assume that people who need it are admitted to hospital around "
+        f"**{constants.HospitalStay.admission_delay}** days after being infected, and stay for around "
+        f"**{constants.HospitalStay.length_of_stay}** days."
+    )
 
     # Do some rounding to avoid beds sounding too precise!
     approx_num_beds = round(num_hospital_beds / 100) * 100
@@ -148,25 +192,24 @@ def run_app():
         "shortage. Many countries are scrambling to buy them [(source)](https://www.reuters.com/article/us-health-coronavirus-draegerwerk-ventil/germany-italy-rush-to-buy-life-saving-ventilators-as-manufacturers-warn-of-shortages-idUSKBN210362)."
     )
 
-    peak_occupancy = df.loc[df.Status == "Need Hospitalization"]["Forecast"].max()
     percent_beds_at_peak = min(100 * num_hospital_beds / peak_occupancy, 100)
 
-    num_beds_comparison_chart = graphing.num_beds_occupancy_comparison_chart(
-        num_beds_available=approx_num_beds, max_num_beds_needed=peak_occupancy, contact_rate=sidebar.contact_rate
-    )
-
-    st.write(num_beds_comparison_chart)
+    st.write(page["figures"]["beds"])
 
     st.markdown(
         f"At peak, **{int(peak_occupancy):,}** people will need hospital beds. ** {percent_beds_at_peak:.1f}% ** of people "
         f"who need a bed in hospital will have access to one given your country's historical resources. This does "
         f"not take into account any special measures that may have been taken in the last few months."
     )
+    if summary.first_day_over_capacity is not None:
+        st.markdown(
+            f"Hospitals will be over capacity from day **{summary.first_day_over_capacity}** to day "
+            f"**{summary.last_day_over_capacity}**, missing a total of **{int(summary.shortfall_bed_days):,}** "
+            f"bed-days."
+        )
 
     st.subheader("How severe will the impact be?")
 
-    num_dead = df[df.Status == "Dead"].Forecast.iloc[-1]
-    num_recovered = df[df.Status == "Recovered"].Forecast.iloc[-1]
     st.markdown(
         f"If the average person in your country adopts the selected behavior, we estimate that **{int(num_dead):,}** "
         f"people will die."
@@ -176,11 +219,7 @@ def run_app():
         f"The graph above below a breakdown of casualties and hospitalizations by age group."
     )
 
-    outcomes_by_age_group = models.get_status_by_age_group(num_dead, num_recovered)
-    fig = graphing.age_segregated_mortality(
-        outcomes_by_age_group.loc[:, ["Dead", "Need Hospitalization"]], contact_rate=sidebar.contact_rate
-    )
-    st.write(fig)
+    st.write(page["figures"]["age"])
 
     st.write(
         f"Parameters by age group, including demographic distribution, are [worldwide numbers](https://population.un.org/wpp/DataQuery/) "
@@ -191,6 +230,25 @@ def run_app():
         f"However, we've adjusted them according to the [maximum mortality rate recorded in Wuhan](https://wwwnc.cdc.gov/eid/article/26/6/20-0233_article)"
         f" when your country's hospitals are overwhelmed: if more people who need them lack hospital beds, more people will die."
     )
+
+    if sidebar.comparison_countries:
+        st.subheader(f"How does {country} compare with other countries?")
+        comparison_df, peak_df = forecast.get_comparison_forecast(
+            countries.country_data,
+            [country] + sidebar.comparison_countries,
+            contact_rate,
+        )
+        st.write(graphing.comparison_infection_graph(comparison_df, contact_rate))
+        st.write(graphing.comparison_beds_chart(peak_df, contact_rate))
+        st.markdown(
+            "At peak, the shortfall of hospital beds would be: "
+            + ", ".join(
+                f"**{int(shortfall):,}** in {other}"
+                for other, shortfall in peak_df["Peak Shortfall"].items()
+            )
+            + "."
+        )
+
     st.write("<hr>", unsafe_allow_html=True)
     st.write(
         "Like this? [Click here to share it on Twitter](https://ctt.ac/u5U39), and "
@@ -199,6 +257,10 @@ def run_app():
 
     utils.insert_github_logo()
 
+    # Users drag the sliders one step at a time, get the next scenarios ready while they look at this one
+    if sidebar.contact_rate_schedule is None:
+        scenario.prefetch_neighbors(countries, country, contact_rate, utils.get_session_id())
+
 
 if __name__ == "__main__":
 
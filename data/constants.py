@@ -3,31 +3,93 @@ Range estimates for various epidemiology constants. Currently only default value
 For sources, please visit https://www.notion.so/Modelling-d650e1351bf34ceeb97c82bd24ae04cc
 """
 
+import datetime
+import functools
 import os
+import tempfile
 from pathlib import Path
 from enum import Enum
 
 import pandas as pd
 
-from data.preprocessing import preprocess_bed_data
-
 READABLE_DATESTRING_FORMAT = "%A %d %B %Y, %H:%M %Z"
 S3_ACCESS_KEY = os.environ.get("AWSAccessKeyId", "").replace("\r", "")
 S3_SECRET_KEY = os.environ.get("AWSSecretKey", "").replace("\r", "")
 S3_BUCKET_NAME = "coronavirus-calculator-data"
-S3_DISEASE_DATA_OBJ_NAME = "full_and_latest_disease_data_dict_v2"
+S3_DISEASE_DATA_OBJ_NAME = "disease_data_index_v4"
+# Historical data, published as a base of one shard per country and deltas named after a hash of their content, and a
+# manifest listing them, see data/shards.py
+S3_HISTORY_SHARD_PREFIX = "history_shards/"
+S3_HISTORY_DELTA_PREFIX = "history_deltas/"
+S3_HISTORY_MANIFEST_OBJ_NAME = "history_manifest_v1"
+# Number of deltas after which a new base is published
+HISTORY_MAX_DELTAS = 30
 DISEASE_DATA_GITHUB_REPO = "https://github.com/CSSEGISandData/COVID-19.git"
 REPO_DIRPATH = "COVID-19"
-DAILY_REPORTS_DIRPATH = "COVID-19/csse_covid_19_data/csse_covid_19_daily_reports"
+DAILY_REPORTS_REPO_PATH = "csse_covid_19_data/csse_covid_19_daily_reports"
+DAILY_REPORTS_DIRPATH = f"{REPO_DIRPATH}/{DAILY_REPORTS_REPO_PATH}"
 DATA_DIR = Path(__file__).parent
+# Shared by every process on the host, so prefer memory-backed storage where there is some
+SNAPSHOT_DIRPATH = Path(
+    os.environ.get(
+        "CORONA_CALCULATOR_SNAPSHOT_DIR",
+        Path("/dev/shm" if Path("/dev/shm").is_dir() else tempfile.gettempdir())
+        / "corona-calculator",
+    )
+)
+SNAPSHOT_MAX_AGE = datetime.timedelta(hours=1)
+# Number of countries whose historical data each process keeps in memory
+HISTORY_CACHE_SIZE = 16
+# Copy of the last data downloaded, used when S3 can't be reached in time
+LOCAL_DATA_CACHE_DIRPATH = Path(
+    os.environ.get(
+        "CORONA_CALCULATOR_CACHE_DIR", Path(tempfile.gettempdir()) / "corona-calculator-cache"
+    )
+)
+DATA_SOURCE_TIMEOUT = datetime.timedelta(seconds=30)
+# Results computed by the app, kept on disk across restarts of its processes, see data/disk_cache.py. Local to each
+# host: on Heroku, each dyno has its own, which is lost when the dyno restarts, at least once a day.
+RESULT_CACHE_DIRPATH = Path(
+    os.environ.get("CORONA_CALCULATOR_RESULT_CACHE_DIR", LOCAL_DATA_CACHE_DIRPATH / "results")
+)
+RESULT_CACHE_MAX_BYTES = 512 * 2 ** 20
+# Peak memory a stage of fetch_live_data.py may allocate before it is flagged by --memory-report. The scheduler
+# dynos it runs on have 512MB, part of which is taken by the interpreter and libraries.
+RELEASE_STAGE_MEMORY_BUDGET_MB = 256
 DEMOGRAPHICS_DATA_PATH = DATA_DIR / "demographics.csv"
 BED_DATA_PATH = DATA_DIR / "world_bank_bed_data.csv"
 AGE_DATA_PATH = DATA_DIR / "age_data.csv"
-DEMOGRAPHIC_DATA = pd.read_csv(DEMOGRAPHICS_DATA_PATH, index_col="Country/Region")
-BED_DATA = preprocess_bed_data(BED_DATA_PATH)
+# Names used by the disease, demographic and bed data sources: name used throughout the app
+COUNTRY_NAME_ALIASES = {
+    "Mainland China": "China",
+    "US": "United States",
+    "Iran, Islamic Rep.": "Iran",
+    "Korea, Rep.": "Korea, South",
+    "Russian Federation": "Russia",
+    "Egypt, Arab Rep.": "Egypt",
+    "Slovak Republic": "Slovakia",
+    "Congo, Dem. Rep.": "Congo (Kinshasa)",
+}
 AGE_DATA = pd.read_csv(AGE_DATA_PATH, index_col="Age Group")
 
 
+@functools.lru_cache(maxsize=None)
+def _load_reference_table(name):
+    if name == "DEMOGRAPHIC_DATA":
+        return pd.read_csv(DEMOGRAPHICS_DATA_PATH, index_col="Country/Region")
+    from data.preprocessing import preprocess_bed_data
+
+    return preprocess_bed_data(BED_DATA_PATH)
+
+
+def __getattr__(name):
+    # DEMOGRAPHIC_DATA and BED_DATA are only read the first time they are used, since web processes usually get them
+    # already joined to the disease data
+    if name in ("DEMOGRAPHIC_DATA", "BED_DATA"):
+        return _load_reference_table(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 class AgeData:
     data = AGE_DATA
 
@@ -64,12 +126,16 @@ class TransmissionRatePerContact:
     # Probability of a contact between carrier and susceptible leading to infection.
     # Found using binomial distribution in Wuhan scenario: 14 contacts per day, 10 infectious days, 2.5 average people infected.
     default = 0.018
-    
+    # Bounds used when fitting a per-country rate to historical data, see calibration.py
+    min = 0.001
+    max = 0.1
+
     # The transmission rate of a asymptomatic infected individual is lower by a certain ratio
     # The ratio is reported to be 55%
     # source: https://science.sciencemag.org/content/early/2020/03/13/science.abb3221
+    asymptomatic_ratio = 0.55
     default_per_symptom_state = {
-        SymptomState.ASYMPTOMATIC : 0.55 * default,
+        SymptomState.ASYMPTOMATIC : asymptomatic_ratio * default,
         SymptomState.SYMPTOMATIC : default,
     }
 
@@ -96,6 +162,9 @@ Health care constants
 class ReportingRate:
     # Proportion of true cases diagnosed
     default = 0.14
+    # Bounds used when fitting a per-country rate to historical data, see calibration.py
+    min = 0.01
+    max = 0.9
 
 
 class AsymptomaticRate:
@@ -109,7 +178,27 @@ class AsymptomaticRate:
 class HospitalizationRate:
     # Cases requiring hospitalization. We multiply by the ascertainment rate because our source got their estimate
     # from the reported cases, whereas we will be using it with total cases.
-    default = 0.19 * ReportingRate.default
+    of_reported_cases = 0.19
+    default = of_reported_cases * ReportingRate.default
+
+
+class HospitalStay:
+    # Mean number of days from infection to hospital admission, and mean length of stay in hospital, for the people
+    # who need it. Rough values from early reports of COVID-19 patients.
+    admission_delay = 7
+    length_of_stay = 10
+    # Each period is split into this many Erlang stages: the more stages, the less the durations vary
+    num_stages = 3
+
+
+class InfectionToDeathDelay:
+    # Days from infection to death: around 5 days of incubation, then around 18 days from the onset of symptoms
+    # https://www.thelancet.com/journals/laninf/article/PIIS1473-3099(20)30243-7/fulltext
+    mean = 23
+    standard_deviation = 9
+    max_days = 60
+    # With fewer deaths than this, they say too little about the number of infections
+    min_deaths = 10
 
 
 NOTION_MODELLING_DOC = (
@@ -1,27 +1,44 @@
-import datetime
+import functools
 
-import streamlit as st
-
-from data.utils import build_country_data, check_if_aws_credentials_present
+from data import snapshot
+from data.loader import build_country_data
+from data.utils import check_if_aws_credentials_present
 
 
 class Countries:
-    def __init__(self, timestamp):
-        self.country_data, self.last_modified, self.historical_country_data = (
-            build_country_data()
-        )
-        self.countries = list(self.country_data.keys())
+    def __init__(self, country_snapshot):
+        self._snapshot = country_snapshot
+        self.version = country_snapshot.version
+        self.country_data = country_snapshot.country_data
+        self.last_modified = country_snapshot.last_modified
+        self.countries = self.country_data.countries
         self.default_selection = self.countries.index("Canada")
-        self.timestamp = timestamp
 
-    @property
-    def stale(self):
-        delta = datetime.datetime.utcnow() - self.timestamp
-        return delta > datetime.timedelta(hours=1)
+    def historical_data(self, country):
+        return self._snapshot.historical_data(country)
 
+    def default_scenario(self, country):
+        return self._snapshot.default_scenario(country)
 
-@st.cache
-def fetch_country_data():
+
+def _build_country_data():
     check_if_aws_credentials_present()
-    timestamp = datetime.datetime.utcnow()
-    return Countries(timestamp=timestamp)
\ No newline at end of file
+    return build_country_data()
+
+
+@functools.lru_cache(maxsize=1)
+def _attach_country_data(version):
+    # The snapshot behind a version never changes, so unlike st.cache there is nothing to hash on each access
+    return Countries(snapshot.attach(version))
+
+
+def fetch_country_data():
+    """
+    Get the country data from the snapshot shared by all processes on this host, refreshing it when it goes stale.
+    """
+    version = snapshot.ensure_current(_build_country_data)
+    try:
+        return _attach_country_data(version)
+    except FileNotFoundError:
+        # Another process published a newer snapshot and removed this one in the meantime
+        return _attach_country_data(snapshot.ensure_current(_build_country_data))
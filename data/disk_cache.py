@@ -0,0 +1,138 @@
+"""
+Cache of results on local disk, which outlives the processes that computed them.
+
+Entries are named after a hash of everything they were computed from (see `key`), so they never go stale: new data
+or a new version of the code computing them gives new keys, and the entries of the old ones are evicted in time.
+Entries are written atomically, so a reader never sees part of one, and the least recently used entries are removed
+once the cache is larger than `max_bytes`. Several processes can share a cache.
+
+The cache is in `$CORONA_CALCULATOR_RESULT_CACHE_DIR`, by default a directory under `$CORONA_CALCULATOR_CACHE_DIR`,
+itself under the temporary directory by default. It is local to a host: on Heroku, each dyno has its own cache,
+which survives restarts of the web processes but not of the dyno, since dynos start from a fresh filesystem (at least
+once a day). Point it at storage that outlives the host to keep entries for longer.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from pathlib import Path
+
+from data.constants import RESULT_CACHE_DIRPATH, RESULT_CACHE_MAX_BYTES
+
+# Once full, evict down to this fraction of the maximum size, so that not every write has to evict
+_EVICTION_TARGET = 0.8
+
+
+def key(*parts):
+    """
+    :param parts: JSON serializable description of what an entry was computed from.
+    :return: Key of the entry.
+    """
+    return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()[:24]
+
+
+class DiskCache:
+    """
+    Entries are bytes, grouped in namespaces (subdirectories) that can be listed, see `recent`.
+    """
+
+    def __init__(self, directory=RESULT_CACHE_DIRPATH, max_bytes=RESULT_CACHE_MAX_BYTES):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        # Size of the cache as last seen by this process, counted on the first write
+        self._size = None
+        self._lock = threading.Lock()
+
+    def _path(self, namespace, key):
+        return self.directory / namespace / key
+
+    def get(self, namespace, key):
+        """
+        :return: Content of the entry, or None if there is none.
+        """
+        path = self._path(namespace, key)
+        try:
+            with open(path, "rb") as f:
+                content = f.read()
+            # Marks the entry as recently used
+            os.utime(path)
+        except FileNotFoundError:
+            # Possibly evicted by another process in the meantime
+            return None
+        return content
+
+    def put(self, namespace, key, content):
+        path = self._path(namespace, key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=".")
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+        try:
+            # Replaced rather than added, e.g. by another process computing the same entry
+            replaced_size = path.stat().st_size
+        except FileNotFoundError:
+            replaced_size = 0
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._entries())
+            else:
+                self._size += len(content) - replaced_size
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def recent(self, namespace, max_entries):
+        """
+        :return: Content of up to `max_entries` entries of `namespace`, most recently used first.
+        """
+        paths = sorted(
+            (self.directory / namespace).glob("[!.]*"),
+            key=_modified_time,
+            reverse=True,
+        )
+        contents = []
+        for path in paths[:max_entries]:
+            try:
+                with open(path, "rb") as f:
+                    contents.append(f.read())
+            except FileNotFoundError:
+                continue
+        return contents
+
+    def _entries(self):
+        """
+        :return: Generator of the path, size and time last used of every entry.
+        """
+        for path in self.directory.glob("**/[!.]*"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            if path.is_file():
+                yield path, stat.st_size, stat.st_mtime
+
+    def _evict(self):
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        self._size = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if self._size <= _EVICTION_TARGET * self.max_bytes:
+                break
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                # Evicted by another process in the meantime
+                pass
+            self._size -= size
+
+
+def _modified_time(path):
+    try:
+        return path.stat().st_mtime
+    except FileNotFoundError:
+        return 0
+
+
+RESULT_CACHE = DiskCache()
@@ -0,0 +1,206 @@
+"""
+Offline stage joining the disease data with demographic, hospital bed and calibration data.
+
+Run by fetch_live_data.py before the data is published, so that the web processes only have to load the result. All
+country name reconciliation between the sources happens here, using `constants.COUNTRY_NAME_ALIASES`.
+"""
+
+import numpy as np
+import pandas as pd
+
+import models
+from data import constants
+from data.constants import COUNTRY_NAME_ALIASES
+from data.table import FIELDS, OPTIONAL_FIELDS
+
+# Fields a country can't be forecast without. A missing calibration just means the defaults are used.
+_REQUIRED_FIELDS = [field for field in FIELDS if field not in OPTIONAL_FIELDS]
+_CUMULATIVE_COLUMNS = ["Confirmed", "Deaths", "Recovered"]
+# Added to the historical data by `add_derived_metrics`
+DERIVED_COLUMNS = [
+    "New Confirmed",
+    "New Deaths",
+    "New Confirmed (7-Day Average)",
+    "New Deaths (7-Day Average)",
+    "Case Growth Rate",
+    "Case Doubling Time",
+    "Active",
+]
+
+
+def apply_country_aliases(df):
+    """
+    Rename countries to the names used throughout the app.
+    :param df: DataFrame indexed by country.
+    """
+    return df.rename(index=COUNTRY_NAME_ALIASES)
+
+
+def join_demographic_data(demographic_data=None, bed_data=None):
+    """
+    Join population and hospital bed data, indexed by country.
+    :param demographic_data: Population data, defaults to `constants.DEMOGRAPHIC_DATA`.
+    :param bed_data: Hospital bed data, defaults to `constants.BED_DATA`.
+    """
+    if demographic_data is None:
+        demographic_data = constants.DEMOGRAPHIC_DATA
+    if bed_data is None:
+        bed_data = constants.BED_DATA
+    demographic_data = apply_country_aliases(demographic_data)
+    demographic_data = demographic_data.merge(
+        apply_country_aliases(bed_data), on="Country/Region"
+    )
+    demographic_data["Num Hospital Beds"] = (
+        demographic_data["Latest Bed Estimate"] * demographic_data["Population"]
+    )
+    return demographic_data
+
+
+def add_derived_metrics(full_disease_data):
+    """
+    Compute metrics derived from the cumulative counts, for every country at once. Days are assumed to follow each
+    other without gaps, as in the daily reports.
+    :param full_disease_data: Historical disease data indexed by country, as in the "full_table" of the data object.
+    :return: Historical data with a single row per country and date, sorted by country then date, with the columns of
+        `DERIVED_COLUMNS` added. The case growth rate is the daily growth of the 7-day average of new cases over the
+        last week, and the doubling time is only given while cases are growing.
+    """
+    # Aliases can map two names reported on the same day to one country
+    df = (
+        full_disease_data.groupby([full_disease_data.index, "Date"])[_CUMULATIVE_COLUMNS]
+        .sum()
+        .reset_index(level="Date")
+    )
+    df.index.name = "Country/Region"
+    by_country = df.groupby(level=0)
+
+    previous_day = by_country[["Confirmed", "Deaths"]].shift(1)
+    previous_week = by_country[["Confirmed", "Deaths"]].shift(7)
+    for column in ["Confirmed", "Deaths"]:
+        # Until there is a day (or week) before, every case counts as new
+        df[f"New {column}"] = df[column] - previous_day[column].fillna(0)
+        df[f"New {column} (7-Day Average)"] = (df[column] - previous_week[column].fillna(0)) / 7
+
+    average_previous_week = df.groupby(level=0)["New Confirmed (7-Day Average)"].shift(7)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        growth_rate = np.log(df["New Confirmed (7-Day Average)"] / average_previous_week) / 7
+    growth_rate[~np.isfinite(growth_rate)] = np.nan
+    df["Case Growth Rate"] = growth_rate
+    df["Case Doubling Time"] = (np.log(2) / growth_rate).where(growth_rate > 0)
+    df["Active"] = df["Confirmed"] - df["Deaths"] - df["Recovered"]
+    return df
+
+
+def _add_calibrated_parameters(country_data, calibration):
+    """
+    Join the per-country parameters fitted by `calibration.calibrate_countries`, falling back to the defaults in
+    data/constants.py for countries without a fit. A missing fit is marked by a NaN "Calibration Loss".
+    """
+    if calibration is None:
+        calibration = pd.DataFrame(
+            columns=["Reporting Rate", "Transmission Rate Per Contact", "Calibration Loss"],
+            dtype=float,
+        )
+    country_data = country_data.join(calibration, how="left")
+    country_data["Reporting Rate"] = country_data["Reporting Rate"].fillna(
+        constants.ReportingRate.default
+    )
+    country_data["Transmission Rate Per Contact"] = country_data[
+        "Transmission Rate Per Contact"
+    ].fillna(constants.TransmissionRatePerContact.default)
+    return country_data
+
+
+def _add_infections_estimated_from_deaths(country_data, full_disease_data):
+    """
+    Nowcast the number of people infected in every country at once from its history of deaths, see
+    `models.estimate_infections_from_deaths`. NaN for countries with too few deaths to tell.
+    """
+    # One row of cumulative deaths per country, one column per date
+    deaths = full_disease_data.pivot_table(
+        index=full_disease_data.index, columns="Date", values="Deaths", aggfunc="sum"
+    )
+    deaths = deaths.reindex(country_data.index).ffill(axis=1).fillna(0)
+    daily_deaths = deaths.diff(axis=1).fillna(deaths.iloc[:, :1]).clip(lower=0)
+
+    infections = models.estimate_infections_from_deaths(
+        daily_deaths.to_numpy(),
+        infection_fatality_rate=constants.MortalityRate.default,
+        delay_distribution=models.get_infection_to_death_delay_distribution(
+            constants.InfectionToDeathDelay.mean,
+            constants.InfectionToDeathDelay.standard_deviation,
+            constants.InfectionToDeathDelay.max_days,
+        ),
+    )
+    country_data["Infections Estimated From Deaths"] = infections
+    country_data.loc[
+        deaths.iloc[:, -1] < constants.InfectionToDeathDelay.min_deaths,
+        "Infections Estimated From Deaths",
+    ] = float("nan")
+    return country_data
+
+
+def validate(country_table, full_disease_data):
+    """
+    Check the joined table before it is published.
+    :raises ValueError: If the table can't be used by the app.
+    """
+    missing_fields = set(FIELDS) - set(country_table.columns)
+    if missing_fields:
+        raise ValueError(f"Country table is missing fields: {sorted(missing_fields)}")
+
+    duplicated = country_table.index[country_table.index.duplicated()]
+    if len(duplicated):
+        raise ValueError(f"Countries appear more than once: {sorted(set(duplicated))}")
+
+    # Check that all of the countries in our selectable dropdown are also present in the full data
+    without_history = set(country_table.index) - set(full_disease_data.index.unique())
+    if without_history:
+        raise ValueError(f"Countries have no historical data: {sorted(without_history)}")
+
+    incomplete = country_table[_REQUIRED_FIELDS].isna().any(axis=1)
+    if incomplete.any():
+        raise ValueError(f"Countries have missing data: {sorted(country_table.index[incomplete])}")
+
+
+def run(data_object, calibrate=None, demographic_data=None):
+    """
+    Clean and join all of the data the app needs.
+    :param data_object: Dict with the "full_table" and "latest_table" of disease data, see `data.utils.download_data`.
+    :param calibrate: Optional function fitting model parameters per country, see `calibration.calibrate_countries`.
+        If not given, any calibration already in `data_object` is kept.
+    :param demographic_data: Output of `join_demographic_data`, if it was already computed.
+    :return: Dict with the cleaned "full_table", including derived metrics (see `add_derived_metrics`), and
+        "latest_table", the "calibration" and the joined "country_table",
+        indexed by country with a column for every field in `data.table.FIELDS`.
+    """
+    full_disease_data = add_derived_metrics(apply_country_aliases(data_object["full_table"]))
+    latest_disease_data = apply_country_aliases(data_object["latest_table"])
+    if demographic_data is None:
+        demographic_data = join_demographic_data()
+
+    if calibrate is not None:
+        calibration = calibrate(full_disease_data, demographic_data)
+    else:
+        calibration = data_object.get("calibration")
+
+    country_table = latest_disease_data.merge(demographic_data, on="Country/Region")
+    country_table = _add_calibrated_parameters(country_table, calibration)
+    country_table = _add_infections_estimated_from_deaths(country_table, full_disease_data)
+    country_table = country_table.loc[:, list(FIELDS)]
+
+    incomplete = country_table[_REQUIRED_FIELDS].isna().any(axis=1)
+    if incomplete.any():
+        print(
+            f"Dropping countries with incomplete data: {', '.join(country_table.index[incomplete])}"
+        )
+        country_table = country_table.loc[~incomplete]
+
+    validate(country_table, full_disease_data)
+
+    return {
+        "full_table": full_disease_data,
+        "latest_table": latest_disease_data,
+        "calibration": calibration,
+        "country_table": country_table,
+    }
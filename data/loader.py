@@ -0,0 +1,155 @@
+"""
+Concurrent loading of the sources the country data is built from.
+
+At startup, the published disease data (S3), the local copy of the last data downloaded and the reference tables
+(populations and hospital beds) are loaded at the same time in threads, each with a timeout, so that a cold start
+takes as long as the slowest source rather than the sum of all of them. If S3 fails or times out, the local copy is
+used; without one, the data is downloaded from the Johns Hopkins repository as before, which has no timeout since
+there is nothing left to fall back to.
+"""
+
+import asyncio
+import datetime
+import os
+import pickle
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from data import etl
+from data.constants import (
+    DATA_SOURCE_TIMEOUT,
+    LOCAL_DATA_CACHE_DIRPATH,
+    READABLE_DATESTRING_FORMAT,
+)
+from data.table import CountryTable
+from data.utils import download_data_from_s3, get_data_locally_or_download
+
+_LOCAL_COPY_FILENAME = "disease_data.pkl"
+
+
+def _read_local_copy(directory):
+    try:
+        with open(directory / _LOCAL_COPY_FILENAME, "rb") as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _write_local_copy(content, last_modified, directory):
+    directory.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory)
+    with os.fdopen(fd, "wb") as f:
+        pickle.dump((content, last_modified), f)
+    os.replace(tmp_path, directory / _LOCAL_COPY_FILENAME)
+
+
+async def _load_source(executor, latencies, name, function, *args, timeout=None):
+    """
+    Run a blocking `function` in a thread of `executor`, recording how long it took in `latencies[name]`. On a
+    timeout the thread is left to finish in the background.
+    """
+    start = time.perf_counter()
+    try:
+        return await asyncio.wait_for(
+            asyncio.get_running_loop().run_in_executor(executor, function, *args), timeout
+        )
+    finally:
+        latencies[name] = time.perf_counter() - start
+
+
+def _report(latencies, results):
+    for name, seconds in latencies.items():
+        result = results.get(name)
+        if isinstance(result, asyncio.TimeoutError):
+            outcome = "timed out"
+        elif isinstance(result, BaseException):
+            outcome = f"failed ({result!r})"
+        elif result is None:
+            outcome = "not available"
+        else:
+            outcome = "loaded"
+        print(f"{name}: {outcome} in {seconds:.2f}s")
+
+
+async def load_data_object(
+    timeout=DATA_SOURCE_TIMEOUT.total_seconds(), cache_directory=LOCAL_DATA_CACHE_DIRPATH
+):
+    """
+    Load the disease data and the reference tables concurrently, falling back to local data if S3 can't be reached.
+    :param timeout: Seconds to wait for each source.
+    :param cache_directory: Directory of the local copy of the data downloaded from S3.
+    :return: Data object as returned by `etl.run`, the date it was last modified, and a dict {source: seconds} of the
+        time spent loading each source.
+    """
+    latencies = {}
+    # Not the loop's default executor, which asyncio.run would wait for even after a source timed out
+    executor = ThreadPoolExecutor(max_workers=3)
+    try:
+        sources = {
+            "S3": (download_data_from_s3,),
+            "Local copy": (_read_local_copy, cache_directory),
+            "Reference tables": (etl.join_demographic_data,),
+        }
+        results = dict(
+            zip(
+                sources,
+                await asyncio.gather(
+                    *(
+                        _load_source(executor, latencies, name, *source, timeout=timeout)
+                        for name, source in sources.items()
+                    ),
+                    return_exceptions=True,
+                ),
+            )
+        )
+
+        demographic_data = results["Reference tables"]
+        if isinstance(demographic_data, BaseException):
+            demographic_data = None
+
+        for name in ["S3", "Local copy"]:
+            objects = results[name]
+            if objects is not None and not isinstance(objects, BaseException):
+                content, last_modified = objects
+                if name == "S3":
+                    _write_local_copy(content, last_modified, cache_directory)
+                data_object = pickle.loads(content)
+                if "country_table" not in data_object:
+                    # Published before fetch_live_data.py ran the ETL stage
+                    data_object = etl.run(data_object, demographic_data=demographic_data)
+                break
+        else:
+            data_object = await _load_source(
+                executor, latencies, "Johns Hopkins repository", get_data_locally_or_download
+            )
+            results["Johns Hopkins repository"] = data_object
+            data_object = etl.run(data_object, demographic_data=demographic_data)
+            last_modified = datetime.datetime.now().strftime(READABLE_DATESTRING_FORMAT)
+    finally:
+        executor.shutdown(wait=False)
+
+    _report(latencies, results)
+    return data_object, last_modified, latencies
+
+
+def build_country_data():
+    """
+    :return: `CountryTable` of the latest statistics, the date the data was last modified, the historical disease data
+        indexed by country or the segments it was published as, see `data.shards.publish`, and the default scenarios
+        pre-rendered by fetch_live_data.py for this table, or None.
+    """
+    data_dict, last_modified, _ = asyncio.run(load_data_object())
+
+    country_data = CountryTable.from_dataframe(data_dict["country_table"])
+    default_scenarios = data_dict.get("default_scenarios")
+    if default_scenarios is not None and default_scenarios["version"] != country_data.version:
+        print("Ignoring default scenarios rendered from different data")
+        default_scenarios = None
+
+    # Published as a series of segments, unless it was built locally
+    historical_data = data_dict.get("history")
+    if historical_data is None:
+        historical_data = data_dict["full_table"]
+
+    return country_data, last_modified, historical_data, default_scenarios
@@ -18,17 +18,5 @@ def preprocess_bed_data(path):
     # Beds are per 1000 people
     df["Latest Bed Estimate"] = df.apply(_get_latest_bed_estimate, axis=1) / 1000
 
-    # Rename countries to match demographics and disease data
-    df = df.rename(
-        index={
-            "Iran, Islamic Rep.": "Iran",
-            "Korea, Rep.": "Korea, South",
-            "Russian Federation": "Russia",
-            "Egypt, Arab Rep.": "Egypt",
-            "Slovak Republic": "Slovakia",
-            "Congo, Dem. Rep.": "Congo (Kinshasa)",
-            # "Brunei Darussalam": "Brunei",
-        }
-    )
-
+    # Country names are matched to the other data sources in data/etl.py
     return df
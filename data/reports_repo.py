@@ -0,0 +1,65 @@
+"""
+Local checkout of the daily reports of the Johns Hopkins repository.
+
+Only the daily reports directory is checked out (a sparse checkout), and only the latest commit is fetched (a shallow
+clone, without the content of files outside the sparse checkout), so a clone takes seconds rather than downloading the
+whole history of every dataset in the repository. Updates fetch the latest commit again, and report which daily
+reports it changed so that only those are parsed again, see `data.utils.pull_latest_data`.
+
+`url` can be any git remote, including the path of a local (bare) repository.
+"""
+
+import subprocess
+from pathlib import Path
+
+from data.constants import DAILY_REPORTS_REPO_PATH, DISEASE_DATA_GITHUB_REPO, REPO_DIRPATH
+
+
+def _git(*args, repo_dirpath=None):
+    command = ["git"] + (["-C", str(repo_dirpath)] if repo_dirpath is not None else []) + list(args)
+    return subprocess.run(command, stdout=subprocess.PIPE, check=True, text=True).stdout
+
+
+def _remote_url(url):
+    # Shallow and partial clones are ignored for plain paths, which git copies instead
+    path = Path(url)
+    return path.resolve().as_uri() if path.exists() else url
+
+
+def clone(url=DISEASE_DATA_GITHUB_REPO, repo_dirpath=REPO_DIRPATH, reports_path=DAILY_REPORTS_REPO_PATH):
+    """
+    Shallow, sparse clone of the daily reports.
+    :return: Directory of the daily reports.
+    """
+    _git(
+        "clone", "--depth", "1", "--filter=blob:none", "--sparse", _remote_url(url), str(repo_dirpath)
+    )
+    _git("sparse-checkout", "set", reports_path, repo_dirpath=repo_dirpath)
+    return Path(repo_dirpath) / reports_path
+
+
+def head(repo_dirpath=REPO_DIRPATH):
+    """
+    :return: Hash of the commit checked out.
+    """
+    return _git("rev-parse", "HEAD", repo_dirpath=repo_dirpath).strip()
+
+
+def pull(repo_dirpath=REPO_DIRPATH, reports_path=DAILY_REPORTS_REPO_PATH):
+    """
+    Update a checkout made by `clone` (or a full clone) to the latest commit of the remote, keeping it shallow.
+    :return: Paths of the daily reports that were added, modified or deleted since the previous commit.
+    """
+    previous_commit = head(repo_dirpath)
+    _git("fetch", "--depth", "1", "origin", "HEAD", repo_dirpath=repo_dirpath)
+    latest_commit = _git("rev-parse", "FETCH_HEAD", repo_dirpath=repo_dirpath).strip()
+    if latest_commit == previous_commit:
+        return []
+
+    # Without rename detection, which would need the content of the files
+    changed = _git(
+        "diff", "--name-only", "--no-renames", previous_commit, latest_commit, "--", reports_path,
+        repo_dirpath=repo_dirpath,
+    ).splitlines()
+    _git("reset", "--hard", "--quiet", latest_commit, repo_dirpath=repo_dirpath)
+    return [Path(repo_dirpath) / path for path in changed]
@@ -0,0 +1,190 @@
+"""
+Historical disease data, published as an append-only series of segments.
+
+Instead of publishing the history of every country on every run, fetch_live_data.py publishes:
+- a base: one object per country, named after a hash of its content,
+- deltas: one object per run that changed the data (usually once a day, when a new daily report comes out), holding
+  the rows of every date that is new or changed since the previous run, named after a hash of its content,
+- a manifest listing them, which also keeps a digest of the rows of each date so that the next run can tell which
+  dates changed without downloading anything else.
+
+Each run then uploads as much data as changed. Once there are `HISTORY_MAX_DELTAS` deltas, a new base is published.
+The data object only keeps the names of the base shards and deltas: web processes download the base shard of a
+country the first time a user selects it, and the deltas they don't already have, see `data.snapshot`.
+
+Segments are written to and read from an object store: S3, or a directory standing in for it, see `LocalObjectStore`.
+"""
+
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+from pathlib import Path
+
+import pandas as pd
+
+from data.constants import (
+    HISTORY_MAX_DELTAS,
+    S3_HISTORY_DELTA_PREFIX,
+    S3_HISTORY_MANIFEST_OBJ_NAME,
+    S3_HISTORY_SHARD_PREFIX,
+)
+from data.etl import DERIVED_COLUMNS
+from data.utils import download_data_from_s3, upload_data_to_s3
+
+HISTORICAL_COLUMNS = ["Date", "Confirmed", "Deaths", "Recovered"] + DERIVED_COLUMNS
+
+
+class S3ObjectStore:
+    def put(self, name, content):
+        """
+        :return: True if the object was uploaded, else False.
+        """
+        return upload_data_to_s3(content, object_name=name)
+
+    def get(self, name):
+        """
+        :return: Content of the object, or None if it couldn't be downloaded.
+        """
+        from botocore.exceptions import BotoCoreError
+
+        try:
+            objects = download_data_from_s3(object_name=name)
+        except BotoCoreError as e:
+            print(e)
+            return None
+        if objects is None:
+            return None
+        content, _ = objects
+        return content
+
+
+class LocalObjectStore:
+    """
+    Stand-in for S3, keeping each object in a file under `directory`.
+    """
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+
+    def put(self, name, content):
+        path = self.directory / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent)
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+        return True
+
+    def get(self, name):
+        try:
+            with open(self.directory / name, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+
+def _key(content):
+    return hashlib.sha1(content).hexdigest()[:16]
+
+
+def _dumps(historical_data):
+    # Data built before some of the derived metrics were added doesn't have them
+    return pickle.dumps(historical_data.reindex(columns=HISTORICAL_COLUMNS))
+
+
+def split(historical_data):
+    """
+    :param historical_data: Historical disease data indexed by country, as in the "full_table" of the data object.
+    :return: Dict {country: (shard key, shard content)}.
+    """
+    shards = {}
+    for country, country_data in historical_data.groupby(level=0, sort=False):
+        content = _dumps(country_data)
+        shards[country] = _key(content), content
+    return shards
+
+
+def loads(content):
+    """
+    :return: Historical data in the same format as the "full_table" of the data object.
+    """
+    return pickle.loads(content)
+
+
+def merge(country, base, deltas):
+    """
+    :param base: Base shard of `country`, or None if it has none.
+    :param deltas: Deltas in the order they were published.
+    :return: Historical data of `country`, where the rows of a delta replace those of the same date before it.
+    """
+    segments = [base] if base is not None else []
+    segments += [delta.loc[delta.index == country] for delta in deltas]
+    if not segments:
+        return None
+    df = pd.concat(segments)
+    return df[~df["Date"].duplicated(keep="last")].sort_values("Date", kind="stable")
+
+
+def _digest_dates(historical_data):
+    """
+    :return: Dict {date: digest of the rows of that date}.
+    """
+    rows = historical_data.reindex(columns=HISTORICAL_COLUMNS).reset_index()
+    row_hashes = pd.util.hash_pandas_object(rows, index=False).to_numpy()
+    return {
+        f"{date:%Y-%m-%d}": hashlib.sha1(row_hashes[positions].tobytes()).hexdigest()[:16]
+        for date, positions in rows.groupby("Date").indices.items()
+    }
+
+
+def read_manifest(store):
+    """
+    :return: The manifest of the published series, or None if there is none.
+    """
+    content = store.get(S3_HISTORY_MANIFEST_OBJ_NAME)
+    return json.loads(content) if content is not None else None
+
+
+def publish(historical_data, store=None, max_deltas=HISTORY_MAX_DELTAS):
+    """
+    Publish the historical data as a delta of the series already published, or as a new base.
+    :param historical_data: Historical disease data indexed by country, as in the "full_table" of the data object.
+    :param store: Object store to publish to, S3 by default.
+    :return: Dict with the "base" {country: shard key} and the "deltas" [delta key] of the series, to be published
+        with the data object, or None if an upload failed.
+    """
+    store = store or S3ObjectStore()
+    previous = read_manifest(store)
+    dates = _digest_dates(historical_data)
+
+    if (
+        previous is None
+        or previous["columns"] != HISTORICAL_COLUMNS
+        or len(previous["deltas"]) >= max_deltas
+        # e.g. a daily report was removed, which a delta can't express
+        or not previous["dates"].keys() <= dates.keys()
+    ):
+        base = {}
+        for country, (key, content) in split(historical_data).items():
+            if not store.put(S3_HISTORY_SHARD_PREFIX + key, content):
+                return None
+            base[country] = key
+        deltas = []
+        print(f"Published a new base of the history of {len(base)} countries")
+    else:
+        base, deltas = previous["base"], previous["deltas"]
+        changed_dates = [date for date, digest in dates.items() if previous["dates"].get(date) != digest]
+        if changed_dates:
+            content = _dumps(historical_data[historical_data["Date"].isin(pd.to_datetime(changed_dates))])
+            key = _key(content)
+            if not store.put(S3_HISTORY_DELTA_PREFIX + key, content):
+                return None
+            deltas = deltas + [key]
+        print(f"Published the history of {len(changed_dates)} new or changed dates")
+
+    manifest = {"columns": HISTORICAL_COLUMNS, "base": base, "deltas": deltas, "dates": dates}
+    if not store.put(S3_HISTORY_MANIFEST_OBJ_NAME, json.dumps(manifest).encode()):
+        return None
+    return {"base": base, "deltas": deltas}
@@ -0,0 +1,295 @@
+"""
+Read-only snapshot of the country data, shared by every process on a host.
+
+The first process to need the data builds it and publishes it as a directory of NumPy arrays. Every process then
+memory-maps those files, so the operating system keeps a single copy in memory however many web workers there are.
+Each snapshot has an explicit version stamp and its data never changes once published: comparing version stamps is
+all it takes to know whether a process holds the latest data.
+
+The historical data is published as a series of segments (see `data.shards`): a base shard per country, which is
+only read, and if need be downloaded, the first time a process shows that country, and deltas for every country.
+Segments are kept in a directory shared by all snapshots, so a new snapshot only downloads the segments that the
+previous ones didn't have. Each process keeps the history of the most recently shown countries in memory.
+"""
+
+import collections
+import datetime
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+import numpy as np
+import pandas as pd
+
+from data import disk_cache, shards
+from data.constants import (
+    HISTORY_CACHE_SIZE,
+    S3_HISTORY_DELTA_PREFIX,
+    S3_HISTORY_SHARD_PREFIX,
+    SNAPSHOT_DIRPATH,
+    SNAPSHOT_MAX_AGE,
+)
+from data.table import FIELDS, CountryTable
+
+# Named after the layout of the snapshots, so processes never attach to one published in an older layout
+_POINTER_FILENAME = "CURRENT-history-series"
+_LOCK_FILENAME = "lock"
+_HISTORY_DIRNAME = "history"
+_DEFAULT_SCENARIOS_DIRNAME = "default_scenarios"
+
+
+class _SuccessCache:
+    """
+    Thread-safe LRU cache of the results of `function` other than None, so that a result that couldn't be computed,
+    e.g. because a segment couldn't be downloaded, is tried again the next time it is needed.
+    """
+
+    def __init__(self, function, max_entries=None):
+        """
+        :param function: Function of a single hashable argument.
+        :param max_entries: Maximum number of results kept, or None for no limit.
+        """
+        self._function = function
+        self._max_entries = max_entries
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __call__(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        value = self._function(key)
+        if value is not None:
+            with self._lock:
+                self._entries[key] = value
+                while self._max_entries is not None and len(self._entries) > self._max_entries:
+                    self._entries.popitem(last=False)
+        return value
+
+
+class Snapshot:
+    """
+    A published version of the country data, memory-mapped read-only.
+    """
+
+    def __init__(self, path, store=None):
+        """
+        :param store: Object store the history was published to, see `data.shards`. S3 by default.
+        """
+        self._path = path
+        self._history_path = path.parent / _HISTORY_DIRNAME
+        self._store = store or shards.S3ObjectStore()
+        with open(path / "meta.json") as f:
+            meta = json.load(f)
+        self.version = meta["version"]
+        self.last_modified = meta["last_modified"]
+
+        # One contiguous row per field, so each column of the table is a zero-copy view
+        table = np.load(path / "country_data.npy", mmap_mode="r")
+        self.country_data = CountryTable(
+            meta["countries"], dict(zip(meta["fields"], table))
+        )
+
+        self._history = meta["history"]
+        self._load_history = _SuccessCache(self._read_history, HISTORY_CACHE_SIZE)
+        # Every country needs all of them, and each only has the rows of a few dates
+        self._load_delta = _SuccessCache(lambda key: self._read_segment(S3_HISTORY_DELTA_PREFIX, key))
+
+    def _read_segment(self, prefix, key):
+        path = self._history_path / f"{key}.pkl"
+        try:
+            with open(path, "rb") as f:
+                content = f.read()
+        except FileNotFoundError:
+            # Also kept on disk, so that they aren't downloaded again after the host restarts
+            content = disk_cache.RESULT_CACHE.get(_HISTORY_DIRNAME, key)
+            if content is None:
+                content = self._store.get(prefix + key)
+                if content is None:
+                    return None
+                disk_cache.RESULT_CACHE.put(_HISTORY_DIRNAME, key, content)
+            # Segments are named after their content, so processes racing to write one write the same bytes
+            _write_atomically(path, content)
+        return shards.loads(content)
+
+    def _read_history(self, country):
+        key = self._history["base"].get(country)
+        base = self._read_segment(S3_HISTORY_SHARD_PREFIX, key) if key is not None else None
+        deltas = [self._load_delta(key) for key in self._history["deltas"]]
+        if (key is not None and base is None) or any(delta is None for delta in deltas):
+            return None
+        return shards.merge(country, base, deltas)
+
+    def historical_data(self, country):
+        """
+        :return: Historical data of `country`, in the same format as the "full_table" of the data object. It is
+            shared with other sessions of this process, so don't modify it. Empty if it isn't available, in which case
+            it is read again on the next call.
+        """
+        df = self._load_history(country)
+        if df is None:
+            df = pd.DataFrame(
+                columns=shards.HISTORICAL_COLUMNS,
+                index=pd.Index([], name="Country/Region"),
+            )
+        return df
+
+    def default_scenario(self, country):
+        """
+        :return: The scenario of `country` with the default contact rates as JSON, see `scenario.to_json`, or None if
+            it wasn't pre-rendered.
+        """
+        if country not in self.country_data:
+            return None
+        row = int(self.country_data.rows([country])[0])
+        try:
+            with open(self._path / _DEFAULT_SCENARIOS_DIRNAME / f"{row}.json") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+
+def _read_pointer(directory):
+    try:
+        with open(directory / _POINTER_FILENAME) as f:
+            pointer = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    pointer["published"] = datetime.datetime.fromisoformat(pointer["published"])
+    return pointer
+
+
+def _write_atomically(path, text):
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent)
+    with os.fdopen(fd, "wb" if isinstance(text, bytes) else "w") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def publish(
+    country_data, last_modified, historical_data, default_scenarios=None, directory=SNAPSHOT_DIRPATH
+):
+    """
+    Publish a new snapshot and make it the current one.
+    :param country_data: `CountryTable`, as returned by `data.loader.build_country_data`.
+    :param last_modified: Date the data was last refreshed.
+    :param historical_data: Historical disease data indexed by country, or the segments published to S3 by
+        fetch_live_data.py (see `data.shards.publish`), as returned by `build_country_data`.
+    :param default_scenarios: Optional pre-rendered scenarios of `country_data`, see
+        `scenario.prerender_default_scenarios`.
+    :return: Version stamp of the snapshot.
+    """
+    pages = default_scenarios["pages"] if default_scenarios is not None else {}
+    countries = country_data.countries
+    fields = list(FIELDS)
+    table = np.stack([country_data.column(field) for field in fields]).astype(float)
+
+    if isinstance(historical_data, dict):
+        history, segment_contents = historical_data, {}
+    else:
+        # Built locally, so the base shards are all written now
+        split = shards.split(historical_data)
+        history = {"base": {country: key for country, (key, _) in split.items()}, "deltas": []}
+        segment_contents = dict(split.values())
+
+    # Segments are named after their content, so their keys stand in for the historical data
+    digest = hashlib.sha1(
+        json.dumps([countries, fields, last_modified, history], sort_keys=True).encode()
+    )
+    digest.update(table.tobytes())
+    digest.update(json.dumps(pages, sort_keys=True).encode())
+    version = digest.hexdigest()[:16]
+
+    history_path = directory / _HISTORY_DIRNAME
+    history_path.mkdir(parents=True, exist_ok=True)
+    for key, content in segment_contents.items():
+        _write_atomically(history_path / f"{key}.pkl", content)
+
+    path = directory / version
+    if not path.exists():
+        # Write everything to a temporary directory and rename it, so nobody attaches a half-written snapshot
+        tmp_path = tempfile.mkdtemp(dir=directory)
+        np.save(os.path.join(tmp_path, "country_data.npy"), table)
+        # One file per country, so that each process only reads the pages it serves
+        os.mkdir(os.path.join(tmp_path, _DEFAULT_SCENARIOS_DIRNAME))
+        for row, country in enumerate(countries):
+            if country in pages:
+                with open(os.path.join(tmp_path, _DEFAULT_SCENARIOS_DIRNAME, f"{row}.json"), "w") as f:
+                    f.write(pages[country])
+        meta = {
+            "version": version,
+            "last_modified": last_modified,
+            "countries": countries,
+            "fields": fields,
+            "history": history,
+        }
+        with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+            json.dump(meta, f)
+        os.rename(tmp_path, path)
+
+    _write_atomically(
+        directory / _POINTER_FILENAME,
+        json.dumps(
+            {"version": version, "published": datetime.datetime.utcnow().isoformat()}
+        ),
+    )
+
+    # Processes still using older snapshots keep their memory maps alive after the files are removed
+    for old_path in directory.iterdir():
+        if old_path.is_dir() and old_path.name not in (version, _HISTORY_DIRNAME):
+            shutil.rmtree(old_path, ignore_errors=True)
+    # Segments replaced by a new base. Processes still using older snapshots download them again if they need them.
+    current_keys = set(history["base"].values()) | set(history["deltas"])
+    for segment_path in history_path.glob("*.pkl"):
+        if segment_path.stem not in current_keys:
+            try:
+                segment_path.unlink()
+            except FileNotFoundError:
+                # Removed by another process publishing at the same time
+                pass
+
+    return version
+
+
+def ensure_current(build, directory=SNAPSHOT_DIRPATH, max_age=SNAPSHOT_MAX_AGE):
+    """
+    Get the version of the current snapshot, building and publishing a new one if there is none or it is older than
+    `max_age`. Only one process on the host builds at a time; the others wait for it and use its snapshot.
+    :param build: Function returning the output of `data.loader.build_country_data`, as passed on to `publish`.
+    :return: Version stamp of the current snapshot.
+    """
+
+    def fresh_version():
+        pointer = _read_pointer(directory)
+        if pointer is not None and datetime.datetime.utcnow() - pointer["published"] < max_age:
+            return pointer["version"]
+        return None
+
+    version = fresh_version()
+    if version is not None:
+        return version
+
+    directory.mkdir(parents=True, exist_ok=True)
+    with open(directory / _LOCK_FILENAME, "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            # Another process may have published while we were waiting for the lock
+            version = fresh_version()
+            if version is None:
+                version = publish(*build(), directory=directory)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+    return version
+
+
+def attach(version, directory=SNAPSHOT_DIRPATH, store=None):
+    """
+    :param store: Object store the history was published to, see `data.shards`. S3 by default.
+    :return: The `Snapshot` with the given version stamp.
+    """
+    return Snapshot(directory / version, store)
@@ -0,0 +1,117 @@
+"""
+Compact storage for the latest per-country statistics: one NumPy column per field, plus an index from country name
+to row. Whole-world computations work on the columns directly; `CountryRecord` gives convenient access to a single
+country.
+"""
+
+import hashlib
+import json
+
+import numpy as np
+
+# Column name: attribute name on `CountryRecord`
+FIELDS = {
+    "Confirmed": "confirmed",
+    "Deaths": "deaths",
+    "Recovered": "recovered",
+    "Population": "population",
+    "Num Hospital Beds": "num_hospital_beds",
+    "Reporting Rate": "reporting_rate",
+    "Transmission Rate Per Contact": "transmission_rate_per_contact",
+    "Calibration Loss": "calibration_loss",
+    "Infections Estimated From Deaths": "infections_estimated_from_deaths",
+}
+# Fields that may be missing (NaN) for some countries, or from data published before they were added
+OPTIONAL_FIELDS = ["Calibration Loss", "Infections Estimated From Deaths"]
+
+
+class CountryRecord:
+    """
+    Statistics of a single country, copied out of a `CountryTable`.
+    """
+
+    __slots__ = ("name",) + tuple(FIELDS.values())
+
+    def __init__(self, name, values):
+        """
+        :param name: Name of the country.
+        :param values: Values of the fields, in the order of `FIELDS`.
+        """
+        self.name = name
+        for attribute, value in zip(FIELDS.values(), values):
+            setattr(self, attribute, value)
+
+    @property
+    def is_calibrated(self):
+        """Whether the model parameters were fitted to this country, see calibration.py."""
+        return not np.isnan(self.calibration_loss)
+
+    def to_dict(self):
+        return {field: getattr(self, attribute) for field, attribute in FIELDS.items()}
+
+    def __repr__(self):
+        return f"CountryRecord({self.name!r}, {self.to_dict()})"
+
+
+class CountryTable:
+    def __init__(self, countries, columns):
+        """
+        :param countries: Country names, one per row.
+        :param columns: Dict {field: 1-D array with one value per country}, with a key for every field in `FIELDS`.
+        """
+        self.countries = list(countries)
+        self._columns = {field: columns[field] for field in FIELDS}
+        self._rows = {country: row for row, country in enumerate(self.countries)}
+
+    @classmethod
+    def from_dataframe(cls, df):
+        """
+        :param df: DataFrame indexed by country, with a column for every field in `FIELDS`, except maybe
+            `OPTIONAL_FIELDS`.
+        """
+        return cls(
+            df.index,
+            {
+                field: df[field].to_numpy(dtype=float)
+                if field in df
+                else np.full(len(df), np.nan)
+                for field in FIELDS
+            },
+        )
+
+    @property
+    def version(self):
+        """
+        Hash of the contents of the table, the same wherever the table was loaded from.
+        """
+        digest = hashlib.sha1(json.dumps(self.countries).encode())
+        for field in FIELDS:
+            digest.update(np.ascontiguousarray(self._columns[field], dtype=float).tobytes())
+        return digest.hexdigest()[:16]
+
+    def column(self, field):
+        """
+        :return: Array of the values of `field` for every country, in the order of `countries`.
+        """
+        return self._columns[field]
+
+    def rows(self, countries):
+        """
+        :return: Array of the row numbers of `countries`, to index the arrays returned by `column`.
+        """
+        return np.array([self._rows[country] for country in countries], dtype=int)
+
+    def __getitem__(self, country):
+        row = self._rows[country]
+        return CountryRecord(
+            country, [column[row].item() for column in self._columns.values()]
+        )
+
+    def __contains__(self, country):
+        return country in self._rows
+
+    def __iter__(self):
+        return iter(self.countries)
+
+    def __len__(self):
+        return len(self.countries)
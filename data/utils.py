@@ -1,103 +1,207 @@
 import datetime
-import os
 import pickle
 import shutil
 import subprocess
+import tracemalloc
+from contextlib import contextmanager
 from io import BytesIO
 from pathlib import Path
 from typing import List
 
-import boto3
+import numpy as np
 import pandas as pd
-from botocore.exceptions import ClientError
 
-from data import constants
+from data import constants, reports_repo
 from data.constants import (
     READABLE_DATESTRING_FORMAT,
     S3_ACCESS_KEY,
     S3_SECRET_KEY,
     S3_BUCKET_NAME,
     S3_DISEASE_DATA_OBJ_NAME,
-    DISEASE_DATA_GITHUB_REPO,
     REPO_DIRPATH,
     DAILY_REPORTS_DIRPATH,
-    DEMOGRAPHIC_DATA,
-    BED_DATA,
 )
 
+_COUNT_COLUMNS = ["Confirmed", "Deaths", "Recovered"]
+# Older daily reports call it "Country/Region", newer ones "Country_Region"
+_REPORT_COLUMNS = {"Country/Region", "Country_Region"} | set(_COUNT_COLUMNS)
+# Counts of every daily report, kept next to the reports so that only the reports changed by a pull are read again
+_DAILY_STATS_CACHE_FILENAME = ".daily_country_stats.pkl"
+
 
 def execute_shell_command(command: List[str]):
     return subprocess.run(command, stdout=subprocess.PIPE).stdout.decode("utf-8")
 
 
-def get_full_and_latest_dataframes_from_csv(csv_filepaths: List[Path]):
+def _get_report_date(csv_filepath: Path):
+    # Daily reports are named e.g. 03-22-2020.csv
+    month, day, year = (int(part) for part in csv_filepath.stem.split("-"))
+    return datetime.datetime(year=year, month=month, day=day)
+
+
+def get_daily_country_stats(csv_filepath: Path):
     """
-    Returns two dataframes - full table (all dates), table of the latest date
+    :return: DataFrame of the int32 counts of a daily report, indexed by country.
     """
-    total_df = None
+    report = pd.read_csv(
+        csv_filepath, usecols=lambda column: column in _REPORT_COLUMNS
+    ).rename(columns={"Country_Region": "Country/Region"})
+    return (
+        report.groupby("Country/Region")
+        .sum()
+        .reindex(columns=_COUNT_COLUMNS, fill_value=0)
+        .astype(np.int32)
+    )
 
-    for fpath in csv_filepaths:
-        stem_split = fpath.stem.split("-")
-        month = int(stem_split[0])
-        day = int(stem_split[1])
-        year = int(stem_split[2])
 
-        curr_df = pd.read_csv(fpath)
-        if "Country_Region" in curr_df.columns:
-            curr_df.rename({"Country_Region": "Country/Region"}, axis=1, inplace=True)
-        country_stats_df = curr_df.groupby("Country/Region").agg(
-            {"Confirmed": "sum", "Deaths": "sum", "Recovered": "sum"}
-        )
+def iter_daily_country_stats(csv_filepaths: List[Path], daily_stats=None):
+    """
+    Read the daily reports one at a time, in date order, and aggregate each by country, so that only one report is
+    parsed at once.
+    :param daily_stats: Optional dict {file name: counts} of the reports read before, which aren't read again. The
+        counts of the other reports are added to it.
+    :return: Generator of the date of each report and a DataFrame of its int32 counts, indexed by country.
+    """
+    for fpath in sorted(csv_filepaths, key=_get_report_date):
+        stats = daily_stats.get(fpath.name) if daily_stats is not None else None
+        if stats is None:
+            stats = get_daily_country_stats(fpath)
+            if daily_stats is not None:
+                daily_stats[fpath.name] = stats
+        yield _get_report_date(fpath), stats
 
-        country_stats_df.reset_index(inplace=True)
-        country_stats_df["Date"] = datetime.datetime(year=year, month=month, day=day)
 
-        if total_df is None:
-            total_df = country_stats_df
-        else:
-            total_df = total_df.append(country_stats_df, ignore_index=True)
+def get_full_and_latest_dataframes(daily_country_stats):
+    """
+    Each day's counts are appended to compact columns of the output (country codes and int32 counts) as they come,
+    which are only turned into the full table at the end. Countries are converted back from codes to names, which is
+    what the ETL stage joins and renames on, rather than kept as a categorical.
+    :param daily_country_stats: Iterable of the date of each daily report and its counts by country, in date order,
+        see `iter_daily_country_stats`.
+    :return: Full table (all dates), table of the latest date.
+    """
+    country_codes = {}
+    codes, counts, dates = [], [], []
+
+    for date, country_stats_df in daily_country_stats:
+        codes.append(
+            np.array(
+                [country_codes.setdefault(country, len(country_codes)) for country in country_stats_df.index],
+                dtype=np.int32,
+            )
+        )
+        counts.append(country_stats_df.to_numpy())
+        dates.append(np.full(len(country_stats_df), np.datetime64(date, "ns")))
 
-    ## Clean data
-    # replacing Mainland china with just China
-    total_df["Country/Region"] = total_df["Country/Region"].replace(
-        "Mainland China", "China"
-    )
-    total_df["Country/Region"] = total_df["Country/Region"].replace(
-        "US", "United States"
-    )
+    # Country names are matched to the other data sources in data/etl.py
 
-    # sort by date, then country name
-    total_df = total_df.sort_values(["Date", "Country/Region"])
+    # Already sorted by date, then country name
+    countries = np.array(list(country_codes), dtype=object)[np.concatenate(codes)]
+    total_df = pd.DataFrame(
+        np.concatenate(counts),
+        columns=_COUNT_COLUMNS,
+        index=pd.Index(countries, name="Country/Region"),
+    )
+    total_df["Date"] = np.concatenate(dates)
 
     # Latest date table
-    latest_date_df = total_df[total_df["Date"] == max(total_df["Date"])]
-
-    # Set country as index
-    latest_date_df = latest_date_df.set_index("Country/Region")
-    total_df = total_df.set_index("Country/Region")
+    latest_date_df = total_df[total_df["Date"] == total_df["Date"].max()]
 
     return total_df, latest_date_df
 
 
-def _get_data_from_repo(path):
-    # Go to daily reports directory and fetch all CSV files
-    csv_filepaths = list(Path(path).glob("*.csv"))
+def get_as_of_data_object(full_df, as_of_date):
+    """
+    The data as it was on a past date, from the daily reports up to and including that date.
+    :param full_df: Full table of all dates, see `get_full_and_latest_dataframes`.
+    :return: Data object in the same format as returned by `download_data`.
+    """
+    full_df = full_df[full_df["Date"] <= as_of_date]
+    return {"full_table": full_df, "latest_table": full_df[full_df["Date"] == as_of_date]}
+
+
+class MemoryReport:
+    """
+    Peak memory allocated by Python (including numpy and pandas buffers) during each stage of a job, see `stage`.
+    """
+
+    def __init__(self, budget_mb=constants.RELEASE_STAGE_MEMORY_BUDGET_MB):
+        self.budget_mb = budget_mb
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Record the peak and net allocations of the code run in this context. Tracing slows allocations down, so it is
+        only on within a stage. Stages can't be nested.
+        """
+        # Restarting clears the traces, so the peak and current sizes only count what the stage allocates
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+        tracemalloc.start()
+        try:
+            yield
+        finally:
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            self.stages[name] = (peak / 2 ** 20, current / 2 ** 20)
+
+    def print(self):
+        print(f"{'Stage':<30}{'Peak MB':>10}{'Retained MB':>14}")
+        for name, (peak, retained) in self.stages.items():
+            flag = "  over budget" if peak > self.budget_mb else ""
+            print(f"{name:<30}{peak:>10.1f}{retained:>14.1f}{flag}")
+
+
+def _read_daily_stats_cache(cache_path, commit):
+    try:
+        with open(cache_path, "rb") as f:
+            cache = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    # e.g. the previous run stopped between pulling and writing the cache
+    return cache["daily_stats"] if cache["commit"] == commit else None
+
+
+def _get_data_from_repo(path, commit, changed_filepaths=None, previous_commit=None):
+    """
+    :param path: Directory of the daily reports, at `commit`.
+    :param changed_filepaths: Daily reports changed since `previous_commit`, see `reports_repo.pull`. The counts of
+        the other reports are read from a cache of the counts of every report at `previous_commit`, if there is one.
+        By default all reports are read.
+    """
+    cache_path = Path(path) / _DAILY_STATS_CACHE_FILENAME
+    daily_stats = None
+    if changed_filepaths is not None:
+        daily_stats = _read_daily_stats_cache(cache_path, previous_commit)
+    if daily_stats is None:
+        daily_stats = {}
+    else:
+        for fpath in changed_filepaths:
+            daily_stats.pop(fpath.name, None)
 
     # Get the full and latest table
-    full_df, latest_df = get_full_and_latest_dataframes_from_csv(csv_filepaths)
+    csv_filepaths = list(Path(path).glob("*.csv"))
+    full_df, latest_df = get_full_and_latest_dataframes(
+        iter_daily_country_stats(csv_filepaths, daily_stats)
+    )
     data_object = {"full_table": full_df, "latest_table": latest_df}
 
+    # Without the reports deleted since the previous commit
+    daily_stats = {fpath.name: daily_stats[fpath.name] for fpath in csv_filepaths}
+    with open(cache_path, "wb") as f:
+        pickle.dump({"commit": commit, "daily_stats": daily_stats}, f)
+
     return data_object
 
 
 def download_data(cleanup=True):
     """
-     Clone the JHU COVID GitHub repo (takes about a minute) and return paths to CSVs.
+    Shallow, sparse clone of the daily reports of the JHU COVID GitHub repo, see `data.reports_repo`, and read them.
     """
-    cmd = ["git", "clone", DISEASE_DATA_GITHUB_REPO]
-    execute_shell_command(cmd)
+    reports_repo.clone()
 
-    data_object = _get_data_from_repo(path=DAILY_REPORTS_DIRPATH)
+    data_object = _get_data_from_repo(DAILY_REPORTS_DIRPATH, reports_repo.head())
 
     if cleanup:
         # Remove GitHub repo directory
@@ -112,14 +216,13 @@ def download_data(cleanup=True):
 def pull_latest_data(path=REPO_DIRPATH):
     print("Updating the local data storage")
 
-    current_dir = os.path.curdir
-
-    # For some reason when I used subprocess I lost the STDOUT
-    os.system(f"cd {path} && git pull")
+    previous_commit = reports_repo.head(path)
+    changed_filepaths = reports_repo.pull(path)
+    print(f"{len(changed_filepaths)} daily reports changed")
 
-    os.system(f"cd {current_dir}")
-
-    data_object = _get_data_from_repo(path=DAILY_REPORTS_DIRPATH)
+    data_object = _get_data_from_repo(
+        DAILY_REPORTS_DIRPATH, reports_repo.head(path), changed_filepaths, previous_commit
+    )
 
     return data_object
 
@@ -137,7 +240,9 @@ def get_data_locally_or_download(data_path_locally=constants.DATA_DIR):
 
 
 def _configure_s3_client():
-    # Upload the file
+    # boto3 takes longer to import than the rest of the data pipeline, and isn't needed without credentials
+    import boto3
+
     s3_client = boto3.client(
         "s3", aws_access_key_id=S3_ACCESS_KEY, aws_secret_access_key=S3_SECRET_KEY
     )
@@ -151,6 +256,8 @@ def upload_data_to_s3(data: bytes, object_name: str = S3_DISEASE_DATA_OBJ_NAME):
     :param object_name: S3 object name.
     :return: True if file was uploaded, else False
     """
+    from botocore.exceptions import ClientError
+
     buf = BytesIO(data)
     s3_client = _configure_s3_client()
     try:
@@ -165,8 +272,12 @@ def download_data_from_s3(object_name: str = S3_DISEASE_DATA_OBJ_NAME):
     """
     Download a file from S3 bucket.
     :param object_name: Name of object to download.
-    :return: Object bytes and date last modified.
+    :return: Object bytes and date last modified, or None if it couldn't be downloaded.
     """
+    if not s3_credentials_present():
+        return None
+    from botocore.exceptions import ClientError
+
     s3_client = _configure_s3_client()
     try:
         download = s3_client.get_object(Key=object_name, Bucket=S3_BUCKET_NAME)
@@ -179,43 +290,12 @@ def download_data_from_s3(object_name: str = S3_DISEASE_DATA_OBJ_NAME):
     return content, last_modified
 
 
-def build_country_data(demographic_data=DEMOGRAPHIC_DATA, bed_data=BED_DATA):
-    # Try to download from S3, else download from JHU
-    objects = download_data_from_s3()
-    if objects is None:
-        data_dict = get_data_locally_or_download()
-        last_modified = datetime.datetime.now().strftime(READABLE_DATESTRING_FORMAT)
-    else:
-        data_dict_pkl_bytes, last_modified = objects
-        data_dict = pickle.loads(data_dict_pkl_bytes)
-
-    full_disease_data, latest_disease_data = (
-        data_dict["full_table"],
-        data_dict["latest_table"],
-    )
-
-    # Rename name "US" to "United States" in demographics data to match bed data
-    demographic_data = demographic_data.rename(index={"US": "United States"})
-    demographic_data = demographic_data.merge(bed_data, on="Country/Region")
-    demographic_data["Num Hospital Beds"] = (
-        demographic_data["Latest Bed Estimate"] * demographic_data["Population"]
-    )
-
-    country_data = latest_disease_data.merge(demographic_data, on="Country/Region")
-    country_data = country_data.loc[
-        :, ["Confirmed", "Deaths", "Recovered", "Population", "Num Hospital Beds"]
-    ]
-
-    # Check that all of the countries in our selectable dropdown are also present in the full data
-    assert set(latest_disease_data.index.unique()).issubset(
-        set(full_disease_data.index.unique())
-    )
-
-    return country_data.to_dict(orient="index"), last_modified, full_disease_data
+def s3_credentials_present():
+    return len(constants.S3_ACCESS_KEY) > 0
 
 
 def check_if_aws_credentials_present():
-    if len(constants.S3_ACCESS_KEY) is 0:
+    if not s3_credentials_present():
         print(
             "No S3 credentials present, using local file storage. "
             "This make some time the first time you run. We will clone "
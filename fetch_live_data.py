@@ -1,11 +1,47 @@
+import argparse
+import contextlib
 import pickle
 
-from data.utils import download_data, upload_data_to_s3
+from calibration import calibrate_countries
+from data import etl, shards
+from data.table import CountryTable
+from data.utils import MemoryReport, download_data, upload_data_to_s3
+from scenario import prerender_default_scenarios
 
 if __name__ == "__main__":
-    data_object = download_data()
-    pickle_byte_obj = pickle.dumps(data_object)
-    success = upload_data_to_s3(pickle_byte_obj)
+    parser = argparse.ArgumentParser(description="Build the country data and publish it to S3.")
+    parser.add_argument(
+        "--memory-report",
+        action="store_true",
+        help="Print the peak memory allocated by each stage, which slows the job down.",
+    )
+    args = parser.parse_args()
+    memory_report = MemoryReport() if args.memory_report else None
+
+    def stage(name):
+        return memory_report.stage(name) if memory_report else contextlib.nullcontext()
+
+    with stage("Download and parse reports"):
+        data_object = download_data()
+    # Do all the joining (and fitting of per-country model parameters) once here, so the app only has to load it
+    with stage("ETL and calibration"):
+        data_object = etl.run(data_object, calibrate=calibrate_countries)
+    # Most visitors only look at the default scenario, render it now rather than on every first visit
+    with stage("Default scenarios"):
+        data_object["default_scenarios"] = prerender_default_scenarios(
+            CountryTable.from_dataframe(data_object["country_table"])
+        )
+    with stage("Upload"):
+        # Only the history that changed since the last run is uploaded
+        history = shards.publish(data_object.pop("full_table"))
+        success = history is not None
+        if success:
+            data_object["history"] = history
+            pickle_byte_obj = pickle.dumps(data_object)
+            success = upload_data_to_s3(pickle_byte_obj)
+
+    if memory_report:
+        memory_report.print()
 
     if success:
         print(f"Results pushed to S3.")
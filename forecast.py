@@ -0,0 +1,214 @@
+"""
+The forecasting pipeline run for each country and choice of contact rates. It does not depend on Streamlit, so that
+the same code backs the app (corona-calculator.py) and the JSON API (api.py).
+"""
+
+import numpy as np
+import pandas as pd
+
+import models
+import sir_kernel
+from data import constants
+
+# Shared by every session in this process: when only a later part of a contact rate schedule changes, the simulation
+# resumes from the state at the start of that part
+_CHECKPOINTS = models.SimulationCheckpoints()
+
+# Without the compiled kernel, the numpy batch of `get_comparison_forecast` takes around 100 ms however few countries
+# it forecasts, while `get_forecast` takes 30-50 ms per country with the versions of runtime.txt and requirements.txt,
+# so up to 3 countries are forecast one at a time; see the timings of benchmarks/comparison_forecast.py
+_MIN_NUMPY_BATCH_SIZE = 4
+
+_COMPARISON_STATUSES = ["Infected", "Need Hospitalization", "Dead"]
+
+
+def get_hospital_stay_model():
+    return models.HospitalStayModel(
+        admission_delay=constants.HospitalStay.admission_delay,
+        length_of_stay=constants.HospitalStay.length_of_stay,
+        num_stages=constants.HospitalStay.num_stages,
+    )
+
+
+def get_true_cases_estimator(country_data):
+    """
+    :param country_data: `CountryRecord` of a single country.
+    """
+    return models.TrueInfectedCasesModel(country_data.reporting_rate)
+
+
+def get_sir_model(country_data, contact_rate):
+    """
+    :param country_data: `CountryRecord` of a single country.
+    :param contact_rate: Daily contacts as a dict {SymptomState : contact_rate}.
+    """
+    asymptomatic_cases_estimator = models.AsymptomaticCasesModel(
+        constants.AsymptomaticRate.default
+    )
+    return models.AsymptomaticSIRModel(
+        transmission_rate_per_contact=models.get_transmission_rate_per_symptom_state(
+            country_data.transmission_rate_per_contact
+        ),
+        contact_rate=contact_rate,
+        asymptomatic_cases_model=asymptomatic_cases_estimator,
+        recovery_rate=constants.RecoveryRate.default,
+        normal_death_rate=constants.MortalityRate.default,
+        critical_death_rate=constants.CriticalDeathRate.default,
+        hospitalization_rate=constants.HospitalizationRate.of_reported_cases
+        * country_data.reporting_rate,
+        hospital_capacity=country_data.num_hospital_beds,
+        hospital_stay_model=get_hospital_stay_model(),
+    )
+
+
+def get_forecast(country_data, contact_rate, contact_rate_schedule=None):
+    """
+    Forecast the spread of the disease in a country.
+    :param contact_rate_schedule: Optional `models.ContactRateSchedule`, overriding `contact_rate`.
+    :return: Long format DataFrame, see `models.get_predictions`, and the `models.SimulationSummary` of the forecast.
+    """
+    return models.get_predictions(
+        cases_estimator=get_true_cases_estimator(country_data),
+        sir_model=get_sir_model(country_data, contact_rate),
+        num_diagnosed=country_data.confirmed,
+        num_recovered=country_data.recovered,
+        num_deaths=country_data.deaths,
+        area_population=country_data.population,
+        contact_rate_schedule=contact_rate_schedule,
+        checkpoints=_CHECKPOINTS if contact_rate_schedule is not None else None,
+        return_summary=True,
+    )
+
+
+def estimate_headline_numbers(country_data, contact_rate):
+    """
+    Fast approximation of `get_headline_numbers`, without running the simulation. See
+    `models.SIRModel.estimate_headline_numbers` for its accuracy.
+    :return: Peak number of people needing hospitalization, final number of dead and final number of recovered.
+    """
+    true_cases = get_true_cases_estimator(country_data).predict(country_data.confirmed)
+    return get_sir_model(country_data, contact_rate).estimate_headline_numbers(
+        susceptible=country_data.population
+        - true_cases
+        - country_data.recovered
+        - country_data.deaths,
+        infected=true_cases,
+        recovered=country_data.recovered,
+        dead=country_data.deaths,
+    )
+
+
+def get_headline_numbers(summary):
+    """
+    Numbers quoted in the text of the app.
+    :param summary: `models.SimulationSummary` returned by `get_forecast`.
+    :return: Peak number of people needing hospitalization, final number of dead and final number of recovered.
+    """
+    return summary.peak_hospitalized, summary.final["Dead"], summary.final["Recovered"]
+
+
+def get_comparison_forecast(country_table, countries, contact_rate):
+    """
+    Forecast several countries at once, in a single batched simulation, or one at a time if there are fewer than
+    `_MIN_NUMPY_BATCH_SIZE` countries and no compiled kernel.
+    :param country_table: `CountryTable` of all countries.
+    :param countries: Names of the countries to forecast.
+    :param contact_rate: Daily contacts as a dict {SymptomState : contact_rate}, the same for every country.
+    :return: Long format DataFrame like the one returned by `get_forecast`, with additional Country and
+        "Percent of Population" columns, and a DataFrame indexed by country of peak hospital bed occupancy and
+        shortfall.
+    """
+    rows = country_table.rows(countries)
+
+    def column(field):
+        return country_table.column(field)[rows]
+
+    if len(countries) < _MIN_NUMPY_BATCH_SIZE and sir_kernel.get_kernel() is None:
+        predictions = _get_predictions_one_by_one(country_table, countries, contact_rate)
+    else:
+        predictions = _get_batch_predictions(column, contact_rate)
+
+    # Show every country up to the point where the last one stops changing
+    num_entries = max(
+        len(models.clip_prediction({"Infected": infected})["Infected"])
+        for infected in predictions["Infected"]
+    )
+    population = column("Population")
+    df = pd.concat(
+        [
+            pd.DataFrame(
+                {
+                    "Days": np.arange(num_entries),
+                    "Forecast": values[:num_entries],
+                    "Percent of Population": 100 * values[:num_entries] / population[i],
+                    "Status": status,
+                    "Country": country,
+                }
+            )
+            for status in _COMPARISON_STATUSES
+            for i, (country, values) in enumerate(zip(countries, predictions[status]))
+        ],
+        ignore_index=True,
+    )
+
+    peak_occupancy = predictions["Need Hospitalization"].max(axis=1)
+    num_hospital_beds = column("Num Hospital Beds")
+    peak_df = pd.DataFrame(
+        {
+            "Num Hospital Beds": num_hospital_beds,
+            "Peak Occupancy": peak_occupancy,
+            "Peak Shortfall": np.maximum(0, peak_occupancy - num_hospital_beds),
+        },
+        index=pd.Index(countries, name="Country"),
+    )
+    return df, peak_df
+
+
+def _get_batch_predictions(column, contact_rate):
+    """
+    :param column: Function returning the array of the values of a field for each country to forecast.
+    :return: Dict of 2-D arrays of shape (number of countries, number of days), one per status.
+    """
+    reporting_rate = column("Reporting Rate")
+    sir_model = models.BatchSIRModel(
+        transmission_rate_per_contact=models.get_transmission_rate_per_symptom_state(
+            column("Transmission Rate Per Contact")
+        ),
+        contact_rate=contact_rate,
+        recovery_rate=constants.RecoveryRate.default,
+        normal_death_rate=constants.MortalityRate.default,
+        critical_death_rate=constants.CriticalDeathRate.default,
+        hospitalization_rate=constants.HospitalizationRate.of_reported_cases
+        * reporting_rate,
+        hospital_capacity=column("Num Hospital Beds"),
+        asymptomatic_rate=constants.AsymptomaticRate.default,
+        hospital_stay_model=get_hospital_stay_model(),
+    )
+    return models.get_batch_predictions(
+        cases_estimator=models.TrueInfectedCasesModel(reporting_rate),
+        sir_model=sir_model,
+        num_diagnosed=column("Confirmed"),
+        num_recovered=column("Recovered"),
+        num_deaths=column("Deaths"),
+        area_population=column("Population"),
+    )
+
+
+def _get_predictions_one_by_one(country_table, countries, contact_rate):
+    """
+    Same as `_get_batch_predictions`, running `get_forecast` for each country.
+    :return: Dict of 2-D arrays of shape (number of countries, number of days), one per status, where each forecast
+        is extended past its clipped flat tail with its last value.
+    """
+    forecasts = []
+    for country in countries:
+        df, _ = get_forecast(country_table[country], contact_rate)
+        forecasts.append(df.pivot(index="Days", columns="Status", values="Forecast"))
+    # With at least one day of flat tail, as `models.clip_prediction` always drops the last day
+    num_days = max(len(df) for df in forecasts) + 1
+    return {
+        status: np.array(
+            [df[status].reindex(range(num_days)).ffill().to_numpy(dtype=float) for df in forecasts]
+        )
+        for status in _COMPARISON_STATUSES
+    }
@@ -1,12 +1,12 @@
 import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
 
 from utils import COLOR_MAP
 from data import constants
 from data.constants import SymptomState
 
 TEMPLATE = "plotly_white"
+# plotly is imported by the functions that draw figures: it is slow to import, and isn't needed to show the pages
+# pre-rendered by fetch_live_data.py
 
 
 def _set_title(fig):
@@ -25,6 +25,8 @@ def _set_legends(fig):
 
 
 def plot_historical_data(df):
+    import plotly.express as px
+
     # Convert wide to long
 
     df = pd.melt(
@@ -45,6 +47,8 @@ def plot_historical_data(df):
 
 
 def plot_true_versus_confirmed(confirmed, predicted):
+    import plotly.express as px
+
     df = pd.DataFrame(
         {
             "Status": ["Confirmed", "Predicted"],
@@ -59,6 +63,8 @@ def plot_true_versus_confirmed(confirmed, predicted):
 
 
 def infection_graph(df, y_max, contact_rate):
+    import plotly.graph_objects as go
+
     asymptomatic_contact_rate = contact_rate[SymptomState.ASYMPTOMATIC]
     symptomatic_contact_rate = contact_rate[SymptomState.SYMPTOMATIC]
 
@@ -118,6 +124,8 @@ def infection_graph(df, y_max, contact_rate):
 
 
 def age_segregated_mortality(df, contact_rate):
+    import plotly.express as px
+
     asymptomatic_contact_rate = contact_rate[SymptomState.ASYMPTOMATIC]
     symptomatic_contact_rate = contact_rate[SymptomState.SYMPTOMATIC]
 
@@ -170,6 +178,8 @@ def num_beds_occupancy_comparison_chart(
     A horizontal bar chart comparing # of beds available compared to 
     max number number of beds needed
     """
+    import plotly.express as px
+
     asymptomatic_contact_rate = contact_rate[SymptomState.ASYMPTOMATIC]
     symptomatic_contact_rate = contact_rate[SymptomState.SYMPTOMATIC]
 
@@ -215,3 +225,77 @@ def num_beds_occupancy_comparison_chart(
     _set_plot_font(fig)
 
     return fig
+
+
+def comparison_infection_graph(df, contact_rate):
+    """
+    Share of the population infected over time, one line per country.
+    :param df: Comparison forecast, see `forecast.get_comparison_forecast`.
+    """
+    import plotly.express as px
+
+    asymptomatic_contact_rate = contact_rate[SymptomState.ASYMPTOMATIC]
+    symptomatic_contact_rate = contact_rate[SymptomState.SYMPTOMATIC]
+
+    fig = px.line(
+        df.loc[df.Status == "Infected"],
+        x="Days",
+        y="Percent of Population",
+        color="Country",
+        template=TEMPLATE,
+    )
+    fig.layout.update(
+        xaxis_title="Number of days from today",
+        yaxis_title="% of population infected",
+        title=dict(
+            text=f"Disease propagation with symptomatic people meeting <b>{int(symptomatic_contact_rate)} "
+            f"</b> and asymptomatic meeting <b>{int(asymptomatic_contact_rate)}</b> people a day"
+        ),
+    )
+    _set_legends(fig)
+    _set_title(fig)
+    _set_plot_font(fig)
+
+    return fig
+
+
+def comparison_beds_chart(peak_df, contact_rate):
+    """
+    Number of beds available compared to the number needed at peak, for each country.
+    :param peak_df: Peak occupancy by country, see `forecast.get_comparison_forecast`.
+    """
+    import plotly.express as px
+
+    asymptomatic_contact_rate = contact_rate[SymptomState.ASYMPTOMATIC]
+    symptomatic_contact_rate = contact_rate[SymptomState.SYMPTOMATIC]
+
+    df = pd.melt(
+        peak_df.rename(columns={"Num Hospital Beds": "Total Beds"}).reset_index(),
+        id_vars="Country",
+        value_vars=["Total Beds", "Peak Occupancy"],
+        var_name="Label",
+        value_name="Value",
+    )
+    fig = px.bar(
+        df,
+        x="Country",
+        y="Value",
+        color="Label",
+        barmode="group",
+        opacity=0.7,
+        template=TEMPLATE,
+    )
+    fig.layout.update(
+        xaxis_title="",
+        yaxis_title="",
+        font=dict(family="Arial", size=15, color=COLOR_MAP["default"]),
+        title=dict(
+            text=f"Peak occupancy with symptomatic people meeting <b>{int(symptomatic_contact_rate)} "
+            f"</b> and asymptomatic meeting <b>{int(asymptomatic_contact_rate)}</b> people a day"
+        ),
+    )
+    _set_legends(fig)
+    _set_title(fig)
+    _set_plot_font(fig)
+
+    return fig
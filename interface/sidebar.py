@@ -1,5 +1,6 @@
 import streamlit as st
 
+import models
 from data import constants
 from utils import generate_html, COLOR_MAP
 
@@ -13,8 +14,13 @@ class Sidebar:
         )
         self.country = country
 
-        transmission_probability = constants.TransmissionRatePerContact.default
+        self.comparison_countries = st.sidebar.multiselect(
+            "Compare with other countries",
+            options=[other for other in countries.countries if other != country],
+        )
+
         country_data = countries.country_data[country]
+        transmission_probability = country_data.transmission_rate_per_contact
         date_last_fetched = countries.last_modified
 
         st.sidebar.markdown(
@@ -34,8 +40,8 @@ class Sidebar:
 
         st.sidebar.markdown(
             body=generate_html(
-                text=f'Population: {int(country_data["Population"]):,}<br>Infected: {int(country_data["Confirmed"]):,}<br>'
-                f'Recovered: {int(country_data["Recovered"]):,}<br>Dead: {int(country_data["Deaths"]):,}',
+                text=f"Population: {int(country_data.population):,}<br>Infected: {int(country_data.confirmed):,}<br>"
+                f"Recovered: {int(country_data.recovered):,}<br>Dead: {int(country_data.deaths):,}",
                 line_height=0,
                 font_family="Arial",
                 font_size="0.9rem",
@@ -94,6 +100,24 @@ class Sidebar:
             for state, description in slider_person_descriptions.items()
         }
 
+        self.contact_rate_schedule = None
+        if st.sidebar.checkbox("Change behavior later on"):
+            change_day = st.sidebar.slider(
+                label="After how many days?", min_value=1, max_value=365, value=60
+            )
+            later_contact_rate = {
+                state: st.sidebar.slider(
+                    label=f"Afterwards, if they {description}",
+                    min_value=constants.AverageDailyContacts.min,
+                    max_value=constants.AverageDailyContacts.max,
+                    value=constants.AverageDailyContacts.default[state],
+                )
+                for state, description in slider_person_descriptions.items()
+            }
+            self.contact_rate_schedule = models.ContactRateSchedule(
+                [(0, self.contact_rate), (change_day, later_contact_rate)]
+            )
+
         st.sidebar.markdown(
             body=generate_html(
                 text=f"We're using an estimated transmission probability of {transmission_probability * 100:.1f}%. "
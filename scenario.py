@@ -0,0 +1,441 @@
+"""
+The forecast numbers and figures shown in the app for one country and choice of contact rates.
+
+Most visitors never move the sliders, so fetch_live_data.py renders the default scenario of every country ahead of time
+(`prerender_default_scenarios`). The pages are published with the data, keyed by the version of the country table they
+were computed from, and the app only computes a scenario itself once the user changes an input.
+
+Users drag the sliders one step at a time, so after serving a scenario the app computes the scenarios one step away
+in the background (`NeighborPrefetcher`). All scenarios computed by the process, including the ones still being
+computed, are kept in a bounded cache that every session reads through `get_cached_scenario`.
+
+Computed scenarios are also written to a cache on disk (see `data.disk_cache`), so that they outlive the process: they
+are read from it instead of being computed again, and a new process loads the most recently used ones for the current
+data into memory (`warm_up_cache`).
+"""
+
+import collections
+import functools
+import json
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+
+import forecast
+import graphing
+import models
+import sir_kernel
+from data import constants, disk_cache
+from data.constants import SymptomState
+
+FIGURES = ["infection", "beds", "age"]
+_NUM_CACHED_DEFAULT_SCENARIOS = 32
+# The figures make up most of the memory of a scenario, around 10 MB each
+_NUM_CACHED_SCENARIOS = 16
+# Few, so that prefetching doesn't slow down the scenarios users are waiting for
+_NUM_PREFETCH_WORKERS = 2
+# Sessions whose prefetches are tracked, the least recently served ones have long moved on
+_NUM_PREFETCH_SESSIONS = 256
+
+
+def get_scenario(country_data, contact_rate, contact_rate_schedule=None):
+    """
+    :param country_data: `CountryRecord` of a single country.
+    :param contact_rate: Daily contacts as a dict {SymptomState : contact_rate}.
+    :param contact_rate_schedule: Optional `models.ContactRateSchedule`, overriding `contact_rate`.
+    :return: Dict with the headline numbers, the `models.SimulationSummary` and the figures of the app, keyed by
+        their name in `FIGURES`.
+    """
+    df, summary = forecast.get_forecast(country_data, contact_rate, contact_rate_schedule)
+    peak_occupancy, num_dead, num_recovered = forecast.get_headline_numbers(summary)
+
+    df_base = df[~df.Status.isin(["Need Hospitalization"])]
+    outcomes_by_age_group = models.get_status_by_age_group(num_dead, num_recovered)
+    figures = {
+        "infection": graphing.infection_graph(df_base, df_base.Forecast.max(), contact_rate),
+        "beds": graphing.num_beds_occupancy_comparison_chart(
+            # Do some rounding to avoid beds sounding too precise!
+            num_beds_available=round(country_data.num_hospital_beds / 100) * 100,
+            max_num_beds_needed=peak_occupancy,
+            contact_rate=contact_rate,
+        ),
+        "age": graphing.age_segregated_mortality(
+            outcomes_by_age_group.loc[:, ["Dead", "Need Hospitalization"]],
+            contact_rate=contact_rate,
+        ),
+    }
+    return {
+        "peak_occupancy": peak_occupancy,
+        "num_dead": num_dead,
+        "num_recovered": num_recovered,
+        "summary": summary,
+        "figures": figures,
+    }
+
+
+def to_json(scenario):
+    return json.dumps(_to_dict(scenario))
+
+
+def _to_dict(scenario):
+    return {
+        "peak_occupancy": int(scenario["peak_occupancy"]),
+        "num_dead": int(scenario["num_dead"]),
+        "num_recovered": int(scenario["num_recovered"]),
+        "summary": scenario["summary"].to_dict(),
+        "figures": {name: figure.to_json() for name, figure in scenario["figures"].items()},
+    }
+
+
+def from_json(text):
+    return _from_dict(json.loads(text))
+
+
+def _from_dict(scenario):
+    import plotly.io
+
+    scenario["summary"] = models.SimulationSummary.from_dict(scenario["summary"])
+    scenario["figures"] = {
+        name: plotly.io.from_json(figure) for name, figure in scenario["figures"].items()
+    }
+    return scenario
+
+
+@functools.lru_cache(maxsize=_NUM_CACHED_DEFAULT_SCENARIOS)
+def get_default_scenario(countries, country):
+    """
+    The pre-rendered scenario of a country with the default contact rates. Rebuilding the figures isn't free, so the
+    most recent ones are kept for all the sessions of this process. Nobody modifies them.
+    :param countries: `data.countries.Countries`, a new one for each version of the data.
+    :return: Scenario like the one returned by `get_scenario`, or None if it wasn't pre-rendered.
+    """
+    text = countries.default_scenario(country)
+    if text is None:
+        return None
+    return from_json(text)
+
+
+def _render_default_scenario_job(country_data):
+    return country_data.name, to_json(
+        get_scenario(country_data, constants.AverageDailyContacts.default)
+    )
+
+
+def prerender_default_scenarios(country_table, max_workers=None):
+    """
+    Render the scenario of every country with the default contact rates, in parallel across processes.
+    :param country_table: `CountryTable` of all countries.
+    :param max_workers: Number of worker processes, defaults to the number of cores.
+    :return: Dict with the "version" of `country_table` and the "pages": a dict {country: scenario as JSON}.
+    """
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        pages = dict(
+            executor.map(
+                _render_default_scenario_job,
+                (country_table[country] for country in country_table),
+                chunksize=8,
+            )
+        )
+    return {"version": country_table.version, "pages": pages}
+
+
+class ScenarioCache:
+    """
+    Bounded, thread-safe cache of scenarios, as futures so that a scenario being computed is only computed once.
+    """
+
+    def __init__(self, max_entries=_NUM_CACHED_SCENARIOS):
+        self._max_entries = max_entries
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        :return: The future of the scenario, or None if it isn't cached.
+        """
+        with self._lock:
+            future = self._entries.get(key)
+            if future is None:
+                return None
+            if future.cancelled():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return future
+
+    def put_if_absent(self, key, future):
+        """
+        :return: The future cached for `key`, which is `future` unless there already was one.
+        """
+        with self._lock:
+            existing = self._entries.get(key)
+            if existing is not None and not existing.cancelled():
+                self._entries.move_to_end(key)
+                return existing
+            self._entries[key] = future
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+            return future
+
+    def discard(self, key, future):
+        with self._lock:
+            if self._entries.get(key) is future:
+                del self._entries[key]
+
+
+_SCENARIO_CACHE = ScenarioCache()
+
+
+class _ActivityCounter:
+    """
+    Number of threads inside a `with` block of the counter.
+    """
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        with self._lock:
+            self.value += 1
+
+    def __exit__(self, *exc_info):
+        with self._lock:
+            self.value -= 1
+
+
+# Scenarios being computed for users who are waiting for them
+_FOREGROUND_COMPUTATIONS = _ActivityCounter()
+
+
+class _PrefetchSkipped(Exception):
+    pass
+
+
+def _get_scenario_key(countries, country, contact_rate):
+    return countries.version, country, tuple(contact_rate[state] for state in SymptomState)
+
+
+_DISK_CACHE = disk_cache.RESULT_CACHE
+# Users shouldn't wait for scenarios to be written to disk
+_DISK_WRITER = ThreadPoolExecutor(max_workers=1, thread_name_prefix="scenario-writer")
+
+
+@functools.lru_cache(maxsize=1)
+def _get_engine_version():
+    # Scenarios on disk are only valid for the code that computed them. plotly is only imported once a scenario is
+    # read or written, like the rest of the figure code.
+    import plotly
+
+    return disk_cache.key(
+        *(Path(module.__file__).read_text() for module in [forecast, graphing, models, sir_kernel, constants]),
+        Path(__file__).read_text(),
+        plotly.__version__,
+    )
+
+
+def _get_disk_namespace(version):
+    # Scenarios of the same data and code, which `warm_up_cache` reads together
+    return f"scenarios/{disk_cache.key(_get_engine_version(), version)}"
+
+
+def _read_from_disk(key):
+    version, country, contact_rates = key
+    content = _DISK_CACHE.get(_get_disk_namespace(version), disk_cache.key(country, contact_rates))
+    return _from_dict(json.loads(content)["scenario"]) if content is not None else None
+
+
+def _write_to_disk(key, scenario):
+    version, country, contact_rates = key
+    entry = {"country": country, "contact_rates": contact_rates, "scenario": _to_dict(scenario)}
+    try:
+        _DISK_CACHE.put(
+            _get_disk_namespace(version),
+            disk_cache.key(country, contact_rates),
+            json.dumps(entry).encode(),
+        )
+    except OSError as e:
+        print(f"Couldn't write scenario to disk: {e}")
+
+
+def get_cached_scenario(countries, country, contact_rate, compute=True):
+    """
+    Like `get_scenario`, but shared with all the sessions of this process, with the scenarios computed by
+    `NeighborPrefetcher`, and with other processes through the cache on disk. Nobody modifies them.
+    :param countries: `data.countries.Countries`.
+    :param compute: Whether to compute the scenario, or wait for it if it is being computed. Otherwise, return None
+        unless it is ready.
+    """
+    key = _get_scenario_key(countries, country, contact_rate)
+    future = _SCENARIO_CACHE.get(key)
+    if future is not None and compute and future.cancel():
+        # Still queued for prefetching behind other scenarios, quicker to compute it now
+        _SCENARIO_CACHE.discard(key, future)
+        future = None
+    if future is not None:
+        if not compute and not future.done():
+            return None
+        try:
+            return future.result()
+        except Exception:
+            # Failed or cancelled in the background, compute it here so that errors are raised to the caller
+            _SCENARIO_CACHE.discard(key, future)
+
+    result = _read_from_disk(key)
+    if result is not None:
+        future = Future()
+        future.set_result(result)
+        _SCENARIO_CACHE.put_if_absent(key, future)
+        return result
+    if not compute:
+        return None
+
+    future = Future()
+    future.set_running_or_notify_cancel()
+    existing = _SCENARIO_CACHE.put_if_absent(key, future)
+    if existing is not future:
+        # Another session started computing it in the meantime
+        return get_cached_scenario(countries, country, contact_rate)
+    try:
+        with _FOREGROUND_COMPUTATIONS:
+            result = get_scenario(countries.country_data[country], contact_rate)
+    except BaseException as e:
+        _SCENARIO_CACHE.discard(key, future)
+        future.set_exception(e)
+        raise
+    future.set_result(result)
+    _DISK_WRITER.submit(_write_to_disk, key, result)
+    return result
+
+
+def get_neighbor_contact_rates(contact_rate):
+    """
+    :return: The contact rates one slider step away from `contact_rate`.
+    """
+    neighbors = []
+    for state in SymptomState:
+        for step in [-1, 1]:
+            value = contact_rate[state] + step
+            if constants.AverageDailyContacts.min <= value <= constants.AverageDailyContacts.max:
+                neighbors.append({**contact_rate, state: value})
+    return neighbors
+
+
+def _prefetch_scenario(key, country_data, contact_rate):
+    if _FOREGROUND_COMPUTATIONS.value:
+        # Threads share the interpreter, so prefetching now would only slow down scenarios users are waiting for
+        raise _PrefetchSkipped()
+    scenario = _read_from_disk(key)
+    if scenario is None:
+        scenario = get_scenario(country_data, contact_rate)
+        _DISK_WRITER.submit(_write_to_disk, key, scenario)
+    return scenario
+
+
+_PREFETCH_EXECUTOR = ThreadPoolExecutor(
+    max_workers=_NUM_PREFETCH_WORKERS, thread_name_prefix="scenario-prefetch"
+)
+
+
+class NeighborPrefetcher:
+    """
+    Computes the scenarios one slider step away from the last one served to a session into the cache of
+    `get_cached_scenario`, on a small thread pool shared by all prefetchers of the process. Work that hasn't started
+    yet is cancelled when the next scenario is served to the session, in particular when the country or the version of
+    the data changes, and it is skipped while the process is busy computing scenarios for other users. Scenarios that
+    were skipped, cancelled or failed are removed from the cache, so that they can be prefetched again.
+    """
+
+    def __init__(self, executor=_PREFETCH_EXECUTOR):
+        self._executor = executor
+        self._pending = []
+        self._lock = threading.Lock()
+
+    def prefetch(self, countries, country, contact_rate):
+        """
+        :param countries: `data.countries.Countries`.
+        :param contact_rate: Contact rates of the scenario just served.
+        """
+        with self._lock:
+            # The user has moved on, the neighbors of the previous scenario are only worth finishing if started
+            self._cancel()
+            if _FOREGROUND_COMPUTATIONS.value:
+                return
+
+            country_data = countries.country_data[country]
+            for neighbor in get_neighbor_contact_rates(contact_rate):
+                key = _get_scenario_key(countries, country, neighbor)
+                if _SCENARIO_CACHE.get(key) is not None:
+                    continue
+                future = self._executor.submit(_prefetch_scenario, key, country_data, neighbor)
+                if _SCENARIO_CACHE.put_if_absent(key, future) is future:
+                    self._pending.append((key, future))
+                    # So that a scenario that was skipped or failed is prefetched again next time
+                    future.add_done_callback(functools.partial(_discard_unless_successful, key))
+                else:
+                    future.cancel()
+
+    def cancel(self):
+        """
+        Cancel the prefetches that haven't started yet.
+        """
+        with self._lock:
+            self._cancel()
+
+    def _cancel(self):
+        for key, future in self._pending:
+            if future.cancel():
+                _SCENARIO_CACHE.discard(key, future)
+        self._pending = []
+
+
+def _discard_unless_successful(key, future):
+    if future.cancelled() or future.exception() is not None:
+        _SCENARIO_CACHE.discard(key, future)
+
+
+# Prefetcher of each session of the app, so that a session being served only cancels its own prefetches
+_SESSION_PREFETCHERS = collections.OrderedDict()
+_SESSION_PREFETCHERS_LOCK = threading.Lock()
+
+
+def prefetch_neighbors(countries, country, contact_rate, session_id):
+    """
+    Start computing the scenarios one slider step away from the one just served by the app, see
+    `NeighborPrefetcher.prefetch`.
+    :param session_id: Identifier of the session the scenario was served to, see `utils.get_session_id`.
+    """
+    with _SESSION_PREFETCHERS_LOCK:
+        prefetcher = _SESSION_PREFETCHERS.pop(session_id, None) or NeighborPrefetcher()
+        _SESSION_PREFETCHERS[session_id] = prefetcher
+        while len(_SESSION_PREFETCHERS) > _NUM_PREFETCH_SESSIONS:
+            _, stale_prefetcher = _SESSION_PREFETCHERS.popitem(last=False)
+            stale_prefetcher.cancel()
+    prefetcher.prefetch(countries, country, contact_rate)
+
+
+_WARMED_UP_VERSIONS = set()
+_WARM_UP_LOCK = threading.Lock()
+
+
+def _warm_up(version, max_entries):
+    entries = [json.loads(content) for content in _DISK_CACHE.recent(_get_disk_namespace(version), max_entries)]
+    # Least recently used first, so that the cache evicts them first
+    for entry in reversed(entries):
+        future = Future()
+        future.set_result(_from_dict(entry["scenario"]))
+        _SCENARIO_CACHE.put_if_absent((version, entry["country"], tuple(entry["contact_rates"])), future)
+    print(f"Loaded {len(entries)} scenarios from disk")
+
+
+def warm_up_cache(countries, max_entries=_NUM_CACHED_SCENARIOS):
+    """
+    Load the scenarios of `countries` most recently used by any process, from the cache on disk into the cache of
+    `get_cached_scenario`. Runs in the background, once per version of the data.
+    :param countries: `data.countries.Countries`.
+    """
+    with _WARM_UP_LOCK:
+        if countries.version in _WARMED_UP_VERSIONS:
+            return
+        _WARMED_UP_VERSIONS.add(countries.version)
+    _PREFETCH_EXECUTOR.submit(_warm_up, countries.version, max_entries)
@@ -0,0 +1,246 @@
+"""
+Global sensitivity analysis of a country's forecast to the epidemiological constants in data/constants.py.
+
+    python sensitivity.py --country Canada --trajectories 2000
+
+Uses the Morris method of elementary effects: each of `--trajectories` random trajectories through the parameter space
+changes the parameters one at a time, and the effect of each change on peak hospitalization and total deaths is
+recorded. A parameter with a large mean absolute effect (mu*) drives the forecast; a large standard deviation (sigma)
+compared to mu* means its effect depends on the other parameters. The whole design is evaluated with
+`models.BatchSIRModel`, split into chunks across a process pool.
+"""
+
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import forecast
+import models
+from data import constants
+from data.constants import SymptomState
+
+# Each parameter varies log-uniformly from half to twice its default, capped at 1 since they are all rates
+_RANGE_FACTOR = 2
+PARAMETERS = [
+    "RecoveryRate",
+    "MortalityRate",
+    "CriticalDeathRate",
+    "TransmissionRatePerContact",
+    "AsymptomaticRate",
+    "ReportingRate",
+    "HospitalizationRate",
+]
+OUTPUTS = ["Peak Hospitalization", "Total Deaths"]
+_CHUNKS_PER_WORKER = 4
+
+
+def get_default_parameters(country_data):
+    """
+    :param country_data: `CountryRecord` of a single country. Its calibrated rates are used where available.
+    :return: Dict {parameter: default value}, with a key for each of `PARAMETERS`.
+    """
+    return {
+        "RecoveryRate": constants.RecoveryRate.default,
+        "MortalityRate": constants.MortalityRate.default,
+        "CriticalDeathRate": constants.CriticalDeathRate.default,
+        "TransmissionRatePerContact": country_data.transmission_rate_per_contact,
+        "AsymptomaticRate": constants.AsymptomaticRate.default,
+        "ReportingRate": country_data.reporting_rate,
+        # Applied to reported cases, as in the app
+        "HospitalizationRate": constants.HospitalizationRate.of_reported_cases,
+    }
+
+
+def get_morris_design(num_trajectories, num_parameters, num_levels=4, seed=None):
+    """
+    Random one-at-a-time trajectories on a grid of `num_levels` levels of the unit hypercube.
+    :return: Array of shape (num_trajectories, num_parameters + 1, num_parameters) of points in [0, 1], and the array
+        of shape (num_trajectories, num_parameters) of the signed step taken by each parameter, in trajectory order
+        of the points.
+    """
+    rng = np.random.RandomState(seed)
+    delta = num_levels / (2 * (num_levels - 1))
+
+    # Start low and step up, or start high and step down, so that every point stays on the grid
+    base = rng.randint(0, num_levels // 2, size=(num_trajectories, num_parameters)) / (num_levels - 1)
+    steps = delta * rng.choice([-1, 1], size=(num_trajectories, num_parameters))
+    base = np.where(steps < 0, base + delta, base)
+
+    design = np.repeat(base[:, None, :], num_parameters + 1, axis=1)
+    order = np.argsort(rng.rand(num_trajectories, num_parameters), axis=1)
+    for trajectory in range(num_trajectories):
+        for position, parameter in enumerate(order[trajectory]):
+            design[trajectory, position + 1 :, parameter] += steps[trajectory, parameter]
+
+    return design, steps
+
+
+def _scale(unit_values, defaults):
+    """
+    Map points of the unit hypercube to parameter values, log-uniformly over the range of each parameter.
+    """
+    low = defaults / _RANGE_FACTOR
+    high = np.minimum(defaults * _RANGE_FACTOR, 1)
+    return low * (high / low) ** unit_values
+
+
+def evaluate(parameters, country_values, contact_rate):
+    """
+    Run the forecast of one country for many sets of parameters at once.
+    :param parameters: Array of shape (number of sets, len(PARAMETERS)).
+    :param country_values: Tuple of the confirmed cases, recovered, deaths, population and number of hospital beds of
+        the country.
+    :param contact_rate: Daily contacts as a dict {SymptomState : contact_rate}.
+    :return: Array of shape (number of sets, len(OUTPUTS)).
+    """
+    confirmed, recovered, deaths, population, num_hospital_beds = country_values
+    (
+        recovery_rate,
+        mortality_rate,
+        critical_death_rate,
+        transmission_rate_per_contact,
+        asymptomatic_rate,
+        reporting_rate,
+        hospitalization_rate,
+    ) = parameters.T
+
+    sir_model = models.BatchSIRModel(
+        transmission_rate_per_contact=models.get_transmission_rate_per_symptom_state(
+            transmission_rate_per_contact
+        ),
+        contact_rate=contact_rate,
+        recovery_rate=recovery_rate,
+        normal_death_rate=mortality_rate,
+        critical_death_rate=critical_death_rate,
+        hospitalization_rate=hospitalization_rate * reporting_rate,
+        hospital_capacity=num_hospital_beds,
+        asymptomatic_rate=asymptomatic_rate,
+        hospital_stay_model=forecast.get_hospital_stay_model(),
+    )
+    predictions = models.get_batch_predictions(
+        cases_estimator=models.TrueInfectedCasesModel(reporting_rate),
+        sir_model=sir_model,
+        num_diagnosed=confirmed,
+        num_recovered=recovered,
+        num_deaths=deaths,
+        area_population=population,
+    )
+    return np.stack(
+        [predictions["Need Hospitalization"].max(axis=1), predictions["Dead"][:, -1]], axis=1
+    )
+
+
+def _evaluate_job(job):
+    return evaluate(*job)
+
+
+def analyze_country(
+    country_data,
+    contact_rate=constants.AverageDailyContacts.default,
+    num_trajectories=1000,
+    num_levels=4,
+    max_workers=None,
+    seed=None,
+):
+    """
+    Morris sensitivity analysis of the forecast of a country.
+    :param country_data: `CountryRecord` of a single country.
+    :param contact_rate: Daily contacts as a dict {SymptomState : contact_rate}.
+    :param num_trajectories: Number of trajectories. The model is run num_trajectories * (len(PARAMETERS) + 1) times.
+    :param num_levels: Number of levels of the grid each parameter takes values on.
+    :param max_workers: Number of worker processes, defaults to the number of cores.
+    :return: Dict {output: DataFrame indexed by parameter}, one for each of `OUTPUTS`, with the mean absolute
+        elementary effect "mu*", the mean "mu" and the standard deviation "sigma", sorted by mu*. Effects are changes
+        of the output when a parameter goes across its whole range.
+    """
+    defaults = np.array([get_default_parameters(country_data)[name] for name in PARAMETERS])
+    design, steps = get_morris_design(num_trajectories, len(PARAMETERS), num_levels, seed)
+    parameters = _scale(design.reshape(-1, len(PARAMETERS)), defaults)
+
+    country_values = (
+        country_data.confirmed,
+        country_data.recovered,
+        country_data.deaths,
+        country_data.population,
+        country_data.num_hospital_beds,
+    )
+    num_chunks = _CHUNKS_PER_WORKER * (max_workers or os.cpu_count())
+    jobs = [
+        (chunk, country_values, contact_rate)
+        for chunk in np.array_split(parameters, num_chunks)
+        if len(chunk)
+    ]
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        outputs = np.concatenate(list(executor.map(_evaluate_job, jobs)))
+    outputs = outputs.reshape(num_trajectories, len(PARAMETERS) + 1, len(OUTPUTS))
+
+    # Consecutive points of a trajectory differ in a single parameter
+    changed = np.argmax(np.diff(design, axis=1) != 0, axis=2)
+    trajectories = np.arange(num_trajectories)[:, None]
+    effects = np.empty((num_trajectories, len(PARAMETERS), len(OUTPUTS)))
+    effects[trajectories, changed] = (
+        np.diff(outputs, axis=1) / steps[trajectories, changed][..., None]
+    )
+
+    return {
+        output: pd.DataFrame(
+            {
+                "mu*": np.abs(effects[..., i]).mean(axis=0),
+                "mu": effects[..., i].mean(axis=0),
+                "sigma": effects[..., i].std(axis=0, ddof=1),
+            },
+            index=pd.Index(PARAMETERS, name="Parameter"),
+        ).sort_values("mu*", ascending=False)
+        for i, output in enumerate(OUTPUTS)
+    }
+
+
+if __name__ == "__main__":
+    from data.countries import fetch_country_data
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--country", default="Canada")
+    parser.add_argument(
+        "--asymptomatic-contacts",
+        type=int,
+        default=constants.AverageDailyContacts.default[SymptomState.ASYMPTOMATIC],
+    )
+    parser.add_argument(
+        "--symptomatic-contacts",
+        type=int,
+        default=constants.AverageDailyContacts.default[SymptomState.SYMPTOMATIC],
+    )
+    parser.add_argument("--trajectories", type=int, default=1000)
+    parser.add_argument("--levels", type=int, default=4)
+    parser.add_argument(
+        "--workers", type=int, default=None, help="Simulation processes, defaults to the number of cores."
+    )
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    country_data = fetch_country_data().country_data[args.country]
+    contact_rate = {
+        SymptomState.ASYMPTOMATIC: args.asymptomatic_contacts,
+        SymptomState.SYMPTOMATIC: args.symptomatic_contacts,
+    }
+
+    start = time.perf_counter()
+    indices = analyze_country(
+        country_data,
+        contact_rate,
+        num_trajectories=args.trajectories,
+        num_levels=args.levels,
+        max_workers=args.workers,
+        seed=args.seed,
+    )
+    elapsed = time.perf_counter() - start
+
+    num_evaluations = args.trajectories * (len(PARAMETERS) + 1)
+    print(f"{args.country}: {num_evaluations:,} model evaluations in {elapsed:.1f}s\n")
+    with pd.option_context("display.float_format", "{:,.0f}".format):
+        for output, df in indices.items():
+            print(f"{output}\n{df}\n")
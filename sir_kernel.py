@@ -0,0 +1,167 @@
+"""
+Optional compiled version of the day-by-day recurrence of `models.SIRModel`, `models.AsymptomaticSIRModel` and
+`models.BatchSIRModel`.
+
+The kernel is compiled with numba if it is installed, the first time a model needs it; otherwise, or when the
+CORONA_CALCULATOR_DISABLE_JIT environment variable is set, the models fall back to their pure Python implementation
+and numba is never imported. Both give exactly the same forecasts, see tests/test_sir_kernel.py.
+"""
+
+import functools
+import os
+
+import numpy as np
+
+_DISABLE_JIT = os.environ.get("CORONA_CALCULATOR_DISABLE_JIT", "") not in ("", "0")
+
+
+def _simulate(
+    susceptible,
+    infected,
+    recovered,
+    dead,
+    hospitalized,
+    population,
+    asymptomatic_rate,
+    asymptomatic_infection_rate,
+    symptomatic_infection_rate,
+    recovery_rate,
+    normal_death_rate,
+    critical_death_rate,
+    hospitalization_rate,
+    hospital_capacity,
+    exit_rates,
+    num_delay_stages,
+    hospital_state,
+    num_days,
+):
+    """
+    Run the recurrence for a batch of simulations. Arguments up to `hospital_capacity` are 1-D float arrays with one
+    element per simulation; death rates are already amortized over the recovery period, as in `models.SIRModel`.
+    The arithmetic follows the Python implementation operation by operation, so that results are identical.
+    :param exit_rates: `models.HospitalStayModel.exit_rates`, or an empty array without a hospital stay model.
+    :param num_delay_stages: `models.HospitalStayModel.num_delay_stages`.
+    :param hospital_state: 2-D array of the number of people in each stage for each simulation, updated in place.
+    :return: 3-D array of shape (5, batch size, num_days + 1) with the values of S, I, R, D and H over time.
+    """
+    batch_size = susceptible.shape[0]
+    num_stages = exit_rates.shape[0]
+    history = np.empty((5, batch_size, num_days + 1))
+
+    for b in range(batch_size):
+        S = susceptible[b]
+        I = infected[b]
+        R = recovered[b]
+        D = dead[b]
+        H = hospitalized[b]
+
+        for t in range(num_days + 1):
+            history[0, b, t] = S
+            history[1, b, t] = I
+            history[2, b, t] = R
+            history[3, b, t] = D
+            history[4, b, t] = H
+            if t == num_days:
+                break
+
+            # There is an additional chance of dying if people are critically ill
+            # and have no access to the medical system.
+            if I > 0:
+                underserved_critically_ill_proportion = min(
+                    1.0, max(0.0, H - hospital_capacity[b]) / I
+                )
+            else:
+                underserved_critically_ill_proportion = 0.0
+            weighted_death_rate = (
+                normal_death_rate[b] * (1 - underserved_critically_ill_proportion)
+                + critical_death_rate[b] * underserved_critically_ill_proportion
+            )
+
+            asymptomatic = I * asymptomatic_rate[b]
+            delta_s_t = (
+                -asymptomatic_infection_rate[b] * asymptomatic * S / population[b]
+            ) + (-symptomatic_infection_rate[b] * (I - asymptomatic) * S / population[b])
+
+            s_t = S + delta_s_t
+            i_t = I - delta_s_t - (weighted_death_rate + recovery_rate[b]) * I
+            r_t = R + recovery_rate[b] * I
+            d_t = D + weighted_death_rate * I
+            if num_stages == 0:
+                h_t = hospitalization_rate[b] * i_t
+            else:
+                h_t = 0.0
+                inflow = hospitalization_rate[b] * -delta_s_t
+                for stage in range(num_stages):
+                    outflow = exit_rates[stage] * hospital_state[b, stage]
+                    hospital_state[b, stage] += inflow - outflow
+                    inflow = outflow
+                    if stage >= num_delay_stages:
+                        h_t += hospital_state[b, stage]
+
+            S = np.rint(s_t)
+            I = np.rint(i_t)
+            R = np.rint(r_t)
+            D = np.rint(d_t)
+            H = np.rint(h_t)
+
+    return history
+
+
+@functools.lru_cache(maxsize=1)
+def get_kernel():
+    """
+    :return: The compiled kernel, with the signature of `_simulate`, or None if it is disabled or numba isn't
+        installed.
+    """
+    if _DISABLE_JIT:
+        return None
+    try:
+        import numba
+    except ImportError:
+        return None
+    return numba.njit(cache=True)(_simulate)
+
+
+def simulate(num_days, hospital_stay_model, hospital_state, **arrays):
+    """
+    Run the compiled kernel, broadcasting scalar and array arguments against each other.
+    :param hospital_stay_model: Optional `models.HospitalStayModel`.
+    :param hospital_state: Number of people in each stage of `hospital_stay_model`, in an array with one more
+        dimension than the other arguments, or None without a model.
+    :param arrays: Keyword arguments of `_simulate` up to `hospital_capacity`.
+    :return: Dict of arrays of shape (batch shape..., num_days + 1), one per status, and the final hospital state,
+        with the same shape as `hospital_state`; or None if there is no compiled kernel.
+    """
+    kernel = get_kernel()
+    if kernel is None:
+        return None
+
+    names = list(arrays)
+    broadcast = np.broadcast_arrays(*(np.asarray(arrays[name], dtype=float) for name in names))
+    batch_shape = broadcast[0].shape
+    flat = {name: np.ascontiguousarray(array.reshape(-1)) for name, array in zip(names, broadcast)}
+
+    if hospital_stay_model is None:
+        exit_rates, num_delay_stages = np.empty(0), 0
+        hospital_state = np.empty(batch_shape + (0,))
+    else:
+        exit_rates, num_delay_stages = hospital_stay_model.exit_rates, hospital_stay_model.num_delay_stages
+    num_stages = len(exit_rates)
+    hospital_state = np.array(
+        np.broadcast_to(hospital_state, batch_shape + (num_stages,)), dtype=float
+    ).reshape(flat[names[0]].size, num_stages)
+
+    history = kernel(
+        exit_rates=exit_rates,
+        num_delay_stages=num_delay_stages,
+        hospital_state=hospital_state,
+        num_days=num_days,
+        **flat,
+    )
+    history = {
+        status: values.reshape(batch_shape + (num_days + 1,))
+        for status, values in zip(
+            ["Susceptible", "Infected", "Recovered", "Dead", "Need Hospitalization"], history
+        )
+    }
+    return history, hospital_state.reshape(batch_shape + (num_stages,))
@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+
+import calibration
+from data import constants
+
+
+def _get_history(country, num_days, growth_rate=1.15):
+    days = np.arange(num_days)
+    return pd.DataFrame(
+        {
+            "Date": pd.Timestamp("2020-03-01") + pd.to_timedelta(days, unit="D"),
+            "Confirmed": (200 * growth_rate ** days).round(),
+            "Deaths": (4 * growth_rate ** days).round(),
+            "Recovered": (20 * growth_rate ** days).round(),
+        },
+        index=pd.Index([country] * num_days, name="Country/Region"),
+    )
+
+
+def test_calibrate_country_within_bounds():
+    result = calibration.calibrate_country(_get_history("Canada", 20), population=3.7e7, hospital_capacity=1e5)
+
+    assert constants.ReportingRate.min <= result["Reporting Rate"] <= constants.ReportingRate.max
+    assert (
+        constants.TransmissionRatePerContact.min
+        <= result["Transmission Rate Per Contact"]
+        <= constants.TransmissionRatePerContact.max
+    )
+    assert np.isfinite(result["Calibration Loss"])
+
+
+def test_calibrate_country_with_missing_counts():
+    history = _get_history("Canada", 20)
+    history.iloc[10, history.columns.get_loc("Deaths")] = np.nan
+
+    assert calibration.calibrate_country(history, population=3.7e7, hospital_capacity=1e5) is None
+
+
+def test_calibrate_countries_skips_countries_that_cannot_be_fitted():
+    france = _get_history("France", 20)
+    france["Deaths"] = np.nan
+    full_disease_data = pd.concat([_get_history("Canada", 20), france, _get_history("Italy", 5)])
+    demographic_data = pd.DataFrame(
+        {"Population": [3.7e7, 6.7e7, 6e7], "Num Hospital Beds": [1e5, 4e5, 2e5]},
+        index=pd.Index(["Canada", "France", "Italy"], name="Country/Region"),
+    )
+
+    fitted = calibration.calibrate_countries(full_disease_data, demographic_data, max_workers=2)
+
+    assert fitted.index.tolist() == ["Canada"]
+    assert fitted.columns.tolist() == calibration.CALIBRATION_COLUMNS
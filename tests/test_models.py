@@ -0,0 +1,125 @@
+import numpy as np
+import pytest
+
+import forecast
+import models
+from data import constants
+from data.constants import SymptomState
+from data.table import FIELDS, CountryTable
+
+# Population, num hospital beds
+_AREAS = [
+    (1e5, 300),
+    (1e6, 3e3),
+    (5e6, 1.5e4),
+    (1e7, 2e4),
+    (3.7e7, 1e5),
+    (8e7, 5e5),
+    (3e8, 9e5),
+    (1.4e9, 6e6),
+]
+# Proportion of the population infected at the start
+_OUTBREAK_SIZES = [1e-5, 1e-4, 1e-3]
+# Asymptomatic, symptomatic contacts
+_CONTACT_RATES = [
+    (0, 0), (1, 1), (3, 2), (5, 3), (10, 5), (15, 8), (25, 10), (20, 20), (30, 30), (40, 40), (50, 50), (60, 60)
+]
+
+# Upper bound of R0: max relative errors in % of the peak hospitalization, dead and recovered, with and without a
+# `HospitalStayModel`, as documented in `SIRModel.estimate_headline_numbers`
+_MAX_ERRORS = {
+    True: {1.5: (1.1, 7.6, 1.8), 2: (1.5, 1.0, 0.7), 5: (2.4, 0.9, 0.5), 10: (2.4, 0.6, 0.2)},
+    False: {1.5: (1.3, 7.6, 1.8), 2: (2.2, 1.1, 0.7), 5: (5.7, 1.3, 0.6), 10: (9.2, 4.6, 0.2)},
+}
+# Max relative error in % of deaths with R0 in 1 - 1.5, in populations larger than the smallest one
+_MAX_DEATHS_ERROR_LARGER_AREAS = 0.5
+# Max errors of the number of dead and recovered when R0 <= 1
+_MAX_ABSOLUTE_ERRORS_SUBCRITICAL = (100, 4000)
+
+
+def _get_sir_model(contact_rate, hospital_capacity, with_stay_model):
+    return models.AsymptomaticSIRModel(
+        transmission_rate_per_contact=models.get_transmission_rate_per_symptom_state(
+            constants.TransmissionRatePerContact.default
+        ),
+        contact_rate={SymptomState.ASYMPTOMATIC: contact_rate[0], SymptomState.SYMPTOMATIC: contact_rate[1]},
+        asymptomatic_cases_model=models.AsymptomaticCasesModel(constants.AsymptomaticRate.default),
+        recovery_rate=constants.RecoveryRate.default,
+        normal_death_rate=constants.MortalityRate.default,
+        critical_death_rate=constants.CriticalDeathRate.default,
+        hospitalization_rate=constants.HospitalizationRate.default,
+        hospital_capacity=hospital_capacity,
+        hospital_stay_model=forecast.get_hospital_stay_model() if with_stay_model else None,
+    )
+
+
+def _get_country_record(confirmed, population, reporting_rate):
+    columns = {field: np.full(1, np.nan) for field in FIELDS}
+    columns.update(
+        {
+            "Confirmed": np.array([confirmed]),
+            "Deaths": np.zeros(1),
+            "Recovered": np.zeros(1),
+            "Population": np.array([population]),
+            "Num Hospital Beds": np.array([10.0]),
+            "Reporting Rate": np.array([reporting_rate]),
+            "Transmission Rate Per Contact": np.array([constants.TransmissionRatePerContact.default]),
+        }
+    )
+    return CountryTable(["Country"], columns)["Country"]
+
+
+@pytest.mark.parametrize("with_stay_model", [True, False])
+def test_estimate_headline_numbers_error_bounds(with_stay_model):
+    max_errors = {max_r0: [0, 0, 0] for max_r0 in _MAX_ERRORS[with_stay_model]}
+    max_deaths_error_larger_areas = 0
+    max_absolute_errors_subcritical = [0, 0]
+    for population, num_hospital_beds in _AREAS:
+        for outbreak_size in _OUTBREAK_SIZES:
+            for contact_rate in _CONTACT_RATES:
+                sir_model = _get_sir_model(contact_rate, num_hospital_beds, with_stay_model)
+                infected = max(population * outbreak_size, 100)
+                _, summary = sir_model.predict(
+                    population - infected, infected, 0, 0, models._DEFAULT_TIME_SCALE, return_summary=True
+                )
+                expected = summary.peak_hospitalized, summary.final["Dead"], summary.final["Recovered"]
+                estimate = sir_model.estimate_headline_numbers(population - infected, infected, 0, 0)
+
+                r0 = sir_model._get_effective_infection_rate() / (
+                    sir_model._recovery_rate + sir_model._normal_death_rate
+                )
+                if r0 <= 1:
+                    for i in range(2):
+                        max_absolute_errors_subcritical[i] = max(
+                            max_absolute_errors_subcritical[i], abs(estimate[i + 1] - expected[i + 1])
+                        )
+                    continue
+                errors = [100 * abs(e - x) / max(x, 1) for e, x in zip(estimate, expected)]
+                band = min(max_r0 for max_r0 in max_errors if r0 <= max_r0)
+                max_errors[band] = [max(a, b) for a, b in zip(max_errors[band], errors)]
+                if band == 1.5 and population > _AREAS[0][0]:
+                    max_deaths_error_larger_areas = max(max_deaths_error_larger_areas, errors[1])
+
+    for max_r0, errors in max_errors.items():
+        assert all(
+            round(error, 1) <= bound for error, bound in zip(errors, _MAX_ERRORS[with_stay_model][max_r0])
+        ), (max_r0, errors)
+    assert round(max_deaths_error_larger_areas, 1) <= _MAX_DEATHS_ERROR_LARGER_AREAS, max_deaths_error_larger_areas
+    assert all(
+        error <= bound for error, bound in zip(max_absolute_errors_subcritical, _MAX_ABSOLUTE_ERRORS_SUBCRITICAL)
+    ), max_absolute_errors_subcritical
+
+
+@pytest.mark.parametrize("population", [1000, 900])
+def test_estimate_headline_numbers_without_susceptible(population):
+    # 100 confirmed cases at a reporting rate of 10% are the whole population, or more
+    country_data = _get_country_record(confirmed=100, population=population, reporting_rate=0.1)
+    contact_rate = {SymptomState.ASYMPTOMATIC: 5, SymptomState.SYMPTOMATIC: 2}
+
+    peak_hospitalized, num_dead, num_recovered = forecast.estimate_headline_numbers(country_data, contact_rate)
+
+    _, summary = forecast.get_forecast(country_data, contact_rate)
+    # Nobody else is infected: the infected die or recover
+    assert peak_hospitalized == summary.peak_hospitalized
+    assert num_dead + num_recovered == pytest.approx(1000, rel=0.01)
+    assert num_dead == pytest.approx(summary.final["Dead"], abs=5)
@@ -0,0 +1,138 @@
+import shutil
+import subprocess
+
+import pandas as pd
+import pytest
+
+from data import reports_repo, utils
+from data.constants import DAILY_REPORTS_REPO_PATH
+
+pytestmark = pytest.mark.skipif(shutil.which("git") is None, reason="git is not installed")
+
+_REPORT_HEADER = "Province_State,Country_Region,Last_Update,Confirmed,Deaths,Recovered\n"
+
+
+def _git(repo_dirpath, *args):
+    subprocess.run(
+        ["git", "-C", str(repo_dirpath), "-c", "user.name=Test", "-c", "user.email=test@example.com"] + list(args),
+        check=True,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+def _write_report(reports_dirpath, name, confirmed):
+    rows = [f"Ontario,Canada,2020-03-22,{confirmed},1,2", f"Quebec,Canada,2020-03-22,{confirmed},0,1"]
+    rows.append(f",France,2020-03-22,{2 * confirmed},3,4")
+    (reports_dirpath / name).write_text(_REPORT_HEADER + "\n".join(rows) + "\n")
+
+
+@pytest.fixture
+def upstream(tmp_path):
+    """
+    Working copy of the upstream repository, and the bare repository it pushes to, which is cloned from.
+    """
+    working_dirpath, bare_dirpath = tmp_path / "upstream", tmp_path / "upstream.git"
+    reports_dirpath = working_dirpath / DAILY_REPORTS_REPO_PATH
+    reports_dirpath.mkdir(parents=True)
+    (working_dirpath / "README.md").write_text("Daily reports\n")
+    # Outside of the daily reports, so not checked out
+    time_series_dirpath = working_dirpath / "csse_covid_19_data" / "csse_covid_19_time_series"
+    time_series_dirpath.mkdir()
+    (time_series_dirpath / "time_series.csv").write_text("a,b\n1,2\n")
+    for day in range(1, 4):
+        _write_report(reports_dirpath, f"03-0{day}-2020.csv", confirmed=10 * day)
+
+    _git(tmp_path, "init", "--bare", str(bare_dirpath))
+    _git(tmp_path, "init", str(working_dirpath))
+    _git(working_dirpath, "add", "-A")
+    _git(working_dirpath, "commit", "-m", "First reports")
+    _git(working_dirpath, "push", str(bare_dirpath), "HEAD:refs/heads/master")
+    _git(bare_dirpath, "symbolic-ref", "HEAD", "refs/heads/master")
+    return working_dirpath, bare_dirpath
+
+
+def _push_changes(working_dirpath, bare_dirpath):
+    """
+    Add, modify and delete a daily report upstream.
+    :return: Names of the reports changed.
+    """
+    reports_dirpath = working_dirpath / DAILY_REPORTS_REPO_PATH
+    _write_report(reports_dirpath, "03-04-2020.csv", confirmed=40)
+    _write_report(reports_dirpath, "03-02-2020.csv", confirmed=25)
+    (reports_dirpath / "03-01-2020.csv").unlink()
+    _git(working_dirpath, "add", "-A")
+    _git(working_dirpath, "commit", "-m", "More reports")
+    _git(working_dirpath, "push", str(bare_dirpath), "HEAD:refs/heads/master")
+    return {"03-04-2020.csv", "03-02-2020.csv", "03-01-2020.csv"}
+
+
+def _read_all(reports_dirpath):
+    return utils.get_full_and_latest_dataframes(
+        utils.iter_daily_country_stats(list(reports_dirpath.glob("*.csv")))
+    )
+
+
+def test_clone_checks_out_only_daily_reports(tmp_path, upstream):
+    _, bare_dirpath = upstream
+
+    reports_dirpath = reports_repo.clone(bare_dirpath, tmp_path / "checkout")
+
+    assert sorted(path.name for path in reports_dirpath.glob("*.csv")) == [
+        "03-01-2020.csv",
+        "03-02-2020.csv",
+        "03-03-2020.csv",
+    ]
+    assert not (tmp_path / "checkout" / "csse_covid_19_data" / "csse_covid_19_time_series").exists()
+
+
+def test_pull_returns_changed_reports(tmp_path, upstream):
+    working_dirpath, bare_dirpath = upstream
+    repo_dirpath = tmp_path / "checkout"
+    reports_dirpath = reports_repo.clone(bare_dirpath, repo_dirpath)
+    assert reports_repo.pull(repo_dirpath) == []
+
+    changed = _push_changes(working_dirpath, bare_dirpath)
+    changed_filepaths = reports_repo.pull(repo_dirpath)
+
+    assert {path.name for path in changed_filepaths} == changed
+    assert all(path.parent == reports_dirpath for path in changed_filepaths)
+    assert sorted(path.name for path in reports_dirpath.glob("*.csv")) == [
+        "03-02-2020.csv",
+        "03-03-2020.csv",
+        "03-04-2020.csv",
+    ]
+    assert reports_repo.head(repo_dirpath) == subprocess.run(
+        ["git", "-C", str(bare_dirpath), "rev-parse", "HEAD"], stdout=subprocess.PIPE, check=True, text=True
+    ).stdout.strip()
+
+
+def test_get_data_from_repo_reads_only_changed_reports(tmp_path, upstream, monkeypatch):
+    working_dirpath, bare_dirpath = upstream
+    repo_dirpath = tmp_path / "checkout"
+    reports_dirpath = reports_repo.clone(bare_dirpath, repo_dirpath)
+    data_object = utils._get_data_from_repo(reports_dirpath, reports_repo.head(repo_dirpath))
+    full_df, latest_df = _read_all(reports_dirpath)
+    pd.testing.assert_frame_equal(data_object["full_table"], full_df)
+    pd.testing.assert_frame_equal(data_object["latest_table"], latest_df)
+
+    _push_changes(working_dirpath, bare_dirpath)
+    previous_commit = reports_repo.head(repo_dirpath)
+    changed_filepaths = reports_repo.pull(repo_dirpath)
+    read_filepaths = []
+    get_daily_country_stats = utils.get_daily_country_stats
+
+    def recording_get_daily_country_stats(csv_filepath):
+        read_filepaths.append(csv_filepath.name)
+        return get_daily_country_stats(csv_filepath)
+
+    monkeypatch.setattr(utils, "get_daily_country_stats", recording_get_daily_country_stats)
+    data_object = utils._get_data_from_repo(
+        reports_dirpath, reports_repo.head(repo_dirpath), changed_filepaths, previous_commit
+    )
+    monkeypatch.undo()
+
+    assert sorted(read_filepaths) == ["03-02-2020.csv", "03-04-2020.csv"]
+    full_df, latest_df = _read_all(reports_dirpath)
+    pd.testing.assert_frame_equal(data_object["full_table"], full_df)
+    pd.testing.assert_frame_equal(data_object["latest_table"], latest_df)
@@ -0,0 +1,151 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from data import disk_cache, etl, shards, snapshot
+from data.constants import (
+    HISTORY_MAX_DELTAS,
+    S3_HISTORY_DELTA_PREFIX,
+    S3_HISTORY_SHARD_PREFIX,
+)
+from data.table import FIELDS, CountryTable
+
+_COUNTRIES = ["Canada", "France", "Italy"]
+_START_DATE = pd.Timestamp("2020-03-01")
+
+
+class _RecordingStore:
+    """
+    Object store recording the names of the objects read from it.
+    """
+
+    def __init__(self, store):
+        self._store = store
+        self.names = []
+
+    def put(self, name, content):
+        return self._store.put(name, content)
+
+    def get(self, name):
+        self.names.append(name)
+        return self._store.get(name)
+
+
+def _get_historical_data(num_days):
+    """
+    :return: Historical data of `_COUNTRIES` over `num_days` days, as in the "full_table" of the data object.
+    """
+    days = np.arange(num_days)
+    df = pd.concat(
+        [
+            pd.DataFrame(
+                {
+                    "Date": _START_DATE + pd.to_timedelta(days, unit="D"),
+                    "Confirmed": (10 * (i + 1) * 1.1 ** days).round(),
+                    "Deaths": (0.1 * (i + 1) * 1.1 ** days).round(),
+                    "Recovered": (1 * (i + 1) * 1.1 ** days).round(),
+                },
+                index=pd.Index([country] * num_days, name="Country/Region"),
+            )
+            for i, country in enumerate(_COUNTRIES)
+        ]
+    )
+    return etl.add_derived_metrics(df)
+
+
+def _assert_same_history(history, historical_data, country):
+    expected = historical_data.loc[[country]].reindex(columns=shards.HISTORICAL_COLUMNS)
+    pd.testing.assert_frame_equal(history, expected)
+
+
+@pytest.fixture
+def store(tmp_path):
+    return shards.LocalObjectStore(tmp_path / "s3")
+
+
+def test_first_publish_writes_base(store):
+    historical_data = _get_historical_data(20)
+
+    history = shards.publish(historical_data, store)
+
+    assert set(history["base"]) == set(_COUNTRIES)
+    assert history["deltas"] == []
+    for country, key in history["base"].items():
+        _assert_same_history(shards.loads(store.get(S3_HISTORY_SHARD_PREFIX + key)), historical_data, country)
+    assert shards.read_manifest(store)["base"] == history["base"]
+
+
+def test_later_publish_writes_delta(store):
+    first = shards.publish(_get_historical_data(20), store)
+    historical_data = _get_historical_data(21)
+
+    history = shards.publish(historical_data, store)
+
+    assert history["base"] == first["base"]
+    assert len(history["deltas"]) == 1
+    delta = shards.loads(store.get(S3_HISTORY_DELTA_PREFIX + history["deltas"][0]))
+    # Only the rows of the new date
+    assert set(delta["Date"]) == {_START_DATE + pd.Timedelta(days=20)}
+    assert sorted(delta.index) == _COUNTRIES
+    # Nothing changed, nothing new to publish
+    assert shards.publish(historical_data, store) == history
+
+
+def test_publish_rolls_over_to_new_base(store):
+    first = shards.publish(_get_historical_data(20), store)
+    for num_deltas in range(1, HISTORY_MAX_DELTAS + 1):
+        history = shards.publish(_get_historical_data(20 + num_deltas), store)
+        assert history["base"] == first["base"]
+        assert len(history["deltas"]) == num_deltas
+
+    historical_data = _get_historical_data(21 + HISTORY_MAX_DELTAS)
+    history = shards.publish(historical_data, store)
+
+    assert history["deltas"] == []
+    assert history["base"].keys() == first["base"].keys()
+    assert history["base"] != first["base"]
+    for country, key in history["base"].items():
+        _assert_same_history(shards.loads(store.get(S3_HISTORY_SHARD_PREFIX + key)), historical_data, country)
+
+
+def test_merge_reproduces_history(store):
+    shards.publish(_get_historical_data(20), store)
+    shards.publish(_get_historical_data(22), store)
+    # A past date revised, e.g. by a correction of a daily report
+    historical_data = _get_historical_data(23)
+    historical_data.loc[historical_data["Date"] == _START_DATE + pd.Timedelta(days=15), "Deaths"] += 1
+    historical_data = etl.add_derived_metrics(historical_data)
+    history = shards.publish(historical_data, store)
+    assert len(history["deltas"]) == 2
+
+    deltas = [shards.loads(store.get(S3_HISTORY_DELTA_PREFIX + key)) for key in history["deltas"]]
+    for country in _COUNTRIES:
+        base = shards.loads(store.get(S3_HISTORY_SHARD_PREFIX + history["base"][country]))
+        _assert_same_history(shards.merge(country, base, deltas), historical_data, country)
+
+
+def test_snapshot_downloads_only_missing_segments(tmp_path, store, monkeypatch):
+    monkeypatch.setattr(disk_cache, "RESULT_CACHE", disk_cache.DiskCache(tmp_path / "results"))
+    country_data = CountryTable(_COUNTRIES, {field: np.ones(len(_COUNTRIES)) for field in FIELDS})
+    snapshot_dirpath = tmp_path / "snapshots"
+    shards.publish(_get_historical_data(20), store)
+    history = shards.publish(_get_historical_data(21), store)
+
+    recording_store = _RecordingStore(store)
+    version = snapshot.publish(country_data, "2020-03-21", history, directory=snapshot_dirpath)
+    snap = snapshot.attach(version, snapshot_dirpath, recording_store)
+    snap.historical_data("Canada")
+    # Only the base shard of the country shown
+    assert sorted(recording_store.names) == sorted(
+        [S3_HISTORY_SHARD_PREFIX + history["base"]["Canada"], S3_HISTORY_DELTA_PREFIX + history["deltas"][0]]
+    )
+
+    historical_data = _get_historical_data(22)
+    history = shards.publish(historical_data, store)
+    recording_store.names = []
+    version = snapshot.publish(country_data, "2020-03-22", history, directory=snapshot_dirpath)
+    snap = snapshot.attach(version, snapshot_dirpath, recording_store)
+
+    _assert_same_history(snap.historical_data("Canada"), historical_data, "Canada")
+    # The base shard and first delta are already on disk
+    assert recording_store.names == [S3_HISTORY_DELTA_PREFIX + history["deltas"][1]]
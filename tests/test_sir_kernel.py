@@ -0,0 +1,107 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+import forecast
+import models
+import sir_kernel
+from data import constants
+from data.constants import SymptomState
+
+pytest.importorskip("numba")
+
+# Population, true cases, num hospital beds
+_AREAS = [(1e5, 100, 300), (5e6, 1000, 1.5e4), (3.7e7, 3e4, 1e5), (1.4e9, 8e4, 6e6)]
+_CONTACT_RATES = [(0, 0), (1, 1), (5, 2), (20, 10), (50, 50)]
+_NUM_DAYS = 365
+
+
+def _get_models(contact_rate, num_hospital_beds, hospital_stay_model):
+    rates = dict(
+        recovery_rate=constants.RecoveryRate.default,
+        normal_death_rate=constants.MortalityRate.default,
+        critical_death_rate=constants.CriticalDeathRate.default,
+        hospitalization_rate=constants.HospitalizationRate.default,
+        hospital_capacity=num_hospital_beds,
+        hospital_stay_model=hospital_stay_model,
+    )
+    return [
+        models.SIRModel(
+            transmission_rate_per_contact=constants.TransmissionRatePerContact.default,
+            contact_rate=contact_rate[1],
+            **rates,
+        ),
+        models.AsymptomaticSIRModel(
+            transmission_rate_per_contact=constants.TransmissionRatePerContact.default_per_symptom_state,
+            contact_rate={SymptomState.ASYMPTOMATIC: contact_rate[0], SymptomState.SYMPTOMATIC: contact_rate[1]},
+            asymptomatic_cases_model=models.AsymptomaticCasesModel(constants.AsymptomaticRate.default),
+            **rates,
+        ),
+    ]
+
+
+def _predict_all(hospital_stay_model):
+    predictions = []
+    for population, infected, num_hospital_beds in _AREAS:
+        for contact_rate in _CONTACT_RATES:
+            for sir_model in _get_models(contact_rate, num_hospital_beds, hospital_stay_model):
+                predictions.append(
+                    sir_model.predict(population - infected, infected, 0, 0, _NUM_DAYS, return_summary=True)
+                )
+
+    population, infected, num_hospital_beds = (np.array(values) for values in zip(*_AREAS))
+    for contact_rate in _CONTACT_RATES:
+        sir_model = models.BatchSIRModel(
+            transmission_rate_per_contact=constants.TransmissionRatePerContact.default_per_symptom_state,
+            contact_rate={SymptomState.ASYMPTOMATIC: contact_rate[0], SymptomState.SYMPTOMATIC: contact_rate[1]},
+            recovery_rate=constants.RecoveryRate.default,
+            normal_death_rate=constants.MortalityRate.default,
+            critical_death_rate=constants.CriticalDeathRate.default,
+            hospitalization_rate=constants.HospitalizationRate.default,
+            hospital_capacity=num_hospital_beds,
+            asymptomatic_rate=constants.AsymptomaticRate.default,
+            hospital_stay_model=hospital_stay_model,
+        )
+        predictions.append(sir_model.predict(population - infected, infected, 0, 0, _NUM_DAYS))
+    return predictions
+
+
+def _assert_identical(reference, other):
+    if isinstance(reference, tuple):
+        (history, summary), (other_history, other_summary) = reference, other
+        assert history == other_history
+        assert summary.to_dict() == other_summary.to_dict()
+    else:
+        for status in reference:
+            np.testing.assert_array_equal(reference[status], other[status])
+
+
+@pytest.mark.parametrize("with_stay_model", [False, True])
+def test_compiled_kernel_identical_to_python(monkeypatch, with_stay_model):
+    if sir_kernel.get_kernel() is None:
+        pytest.skip("The compiled kernel is disabled")
+    hospital_stay_model = forecast.get_hospital_stay_model() if with_stay_model else None
+
+    compiled = _predict_all(hospital_stay_model)
+    monkeypatch.setattr(sir_kernel, "get_kernel", lambda: None)
+    reference = _predict_all(hospital_stay_model)
+
+    assert len(compiled) == len(reference)
+    for reference_predictions, compiled_predictions in zip(reference, compiled):
+        _assert_identical(reference_predictions, compiled_predictions)
+
+
+def test_disabled_kernel_does_not_import_numba():
+    env = dict(os.environ, CORONA_CALCULATOR_DISABLE_JIT="1")
+    script = (
+        "import sys, models, sir_kernel\n"
+        "models.SIRModel(0.02, 10, 0.1, 0.01, 0.1, 0.1, 100).predict(990, 10, 0, 0, 10)\n"
+        "assert sir_kernel.get_kernel() is None\n"
+        "assert 'numba' not in sys.modules\n"
+    )
+    subprocess.run(
+        [sys.executable, "-c", script], cwd=os.path.join(os.path.dirname(__file__), ".."), env=env, check=True
+    )
@@ -1,5 +1,3 @@
-import streamlit as st
-
 _SUSCEPTIBLE_COLOR = "rgba(230,230,230,.4)"
 _RECOVERED_COLOR = "rgba(180,200,180,.4)"
 
@@ -37,7 +35,20 @@ def generate_html(
 graph_warning = "Please be aware the scale of this graph changes!"
 
 
+def get_session_id():
+    """
+    :return: Identifier of the Streamlit session running the script, or None outside of a session.
+    """
+    from streamlit.ReportThread import get_report_ctx
+
+    ctx = get_report_ctx()
+    return ctx.session_id if ctx is not None else None
+
+
 def insert_github_logo():
+    # Only imported here so that graphing can be used without streamlit, e.g. by fetch_live_data.py
+    import streamlit as st
+
     st.markdown(
         "<br>"
         '<div style="text-align: center;">'